@@ -6,12 +6,27 @@ Created on Sat Nov 27 15:48:47 2021
 @author: jane & krina & diana
 """
 
+import argparse
+import array
+from concurrent.futures import ProcessPoolExecutor
+import contextlib
 import csv
-import matplotlib.pyplot as plt
+from collections import namedtuple
+import hashlib
+import importlib.util
+import os
+import json
+import re
+import sys
+import time
+import tracemalloc
+import warnings
 import numpy as np 
-from sklearn.linear_model import LinearRegression
 # Note: pers abbreviates for personality
 
+# Note: matplotlib, scipy and sklearn are imported inside the functions that 
+# use them, so runs that only print the GNI and personality data start fast
+
 """
 Background Info:
 Myers and Briggs theorized that our preferences on each of the four dimensions 
@@ -75,6 +90,110 @@ average incomes in a bar graph.
 """
 GNI_FILE = "GNI_per_capita.csv"
 
+# Both files live next to this module, so it can be imported and run from any
+# working directory
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+
+"""
+A CountryTable holds one of the files parsed into columns: the country name 
+of each row, the label of each numeric column (the years for GNI_FILE and the 
+personality types for PERSONALITY_FILE) and a 2d float64 array of the values 
+with one row per country. Missing values ('..' or blank cells) are NaN.
+"""
+CountryTable = namedtuple("CountryTable", ["countries", "columns", "values"])
+
+"""
+According to the US news, these are the top 10 countries in the world. This 
+is according to agility, entrepreneurship, quality of life, movers, social 
+purpose, cultural influence, open for business, power, adventure, and 
+heritage.
+"""
+TOP_COUNTRIES = ["Canada", "Japan", "Germany", "Switzerland", "Australia", 
+                 "United States", "New Zealand", "United Kingdom", "Sweden", 
+                 "Netherlands"]
+
+# Named lsts of countries that can be picked on the command line with 
+# --group. The files do not say which region a country is in, so any other 
+# grouping has to be added here.
+COUNTRY_GROUPS = {"top10": TOP_COUNTRIES}
+
+"""
+The two files do not always spell a country the same way. This table maps 
+the other names of a country (as in PERSONALITY_FILE or in common use) to 
+the name used in GNI_FILE, so that join_country_tables can match them. 
+Names are compared after normalize_country_name, so case and spacing do not 
+matter. Pass a dictionary of your own to join_country_tables to change it.
+"""
+COUNTRY_ALIASES = {
+    "United States of America": "United States",
+    "USA": "United States",
+    "UK": "United Kingdom",
+    "Czech Republic": "Czechia",
+    "Russia": "Russian Federation",
+    "South Korea": "Korea (Republic of)",
+    "Korea, South": "Korea (Republic of)",
+    "Vietnam": "Viet Nam",
+    "Laos": "Lao People's Democratic Republic",
+    "Moldova": "Moldova (Republic of)",
+    "Macedonia": "North Macedonia",
+    "Syria": "Syrian Arab Republic",
+    "Tanzania": "Tanzania (United Republic of)",
+    "Brunei": "Brunei Darussalam",
+    "Congo (Kinshasa)": "Congo (Democratic Republic of the)",
+    "Democratic Republic of the Congo": "Congo (Democratic Republic of the)",
+    "Congo (Brazzaville)": "Congo",
+    "Iran": "Iran (Islamic Republic of)",
+    "Bolivia": "Bolivia (Plurinational State of)",
+    "Venezuela": "Venezuela (Bolivarian Republic of)",
+    "Micronesia": "Micronesia (Federated States of)",
+    "Hong Kong": "Hong Kong; China (SAR)",
+    "Palestine": "Palestine; State of",
+    "Eswatini": "Eswatini (Kingdom of)",
+    "Swaziland": "Eswatini (Kingdom of)",
+    "Cape Verde": "Cabo Verde",
+    "East Timor": "Timor-Leste",
+    "Ivory Coast": "Côte d'Ivoire",
+    # GNI_FILE has this name with its "ô" garbled
+    "CÃ´te d'Ivoire": "Côte d'Ivoire",
+    }
+
+"""
+The poles of the five personality axes, in the order they are written in a 
+type like "INFP-T": the letter for each of the four Myers-Briggs dimensions 
+(I/E, S/N, T/F, J/P) and then the identity (Assertive/Turbulent) after the 
+dash. Each pole is (position of its letter in the type, letter, name).
+"""
+TYPE_POLES = [(0, "I", "Introvert"), (0, "E", "Extravert"), 
+              (1, "S", "Sensing"), (1, "N", "Intuitive"), 
+              (2, "T", "Thinking"), (2, "F", "Feeling"), 
+              (3, "J", "Judging"), (3, "P", "Perceiving"), 
+              (4, "A", "Assertive"), (4, "T", "Turbulent")]
+
+# The ways of measuring how far apart the personality profiles of two 
+# countries are, for pairwise_distances
+DISTANCE_METRICS = ("cosine", "jensen-shannon")
+
+# CountryDataset.similar_countries keeps the distances between every pair 
+# of countries up to this many countries; above it, only the distances from 
+# the country asked about are worked out for each query
+FULL_DISTANCE_LIMIT = 2000
+
+# The personality type whose share is regressed against the average GNI per 
+# capita. It is the most common type in every one of TOP_COUNTRIES; a fixed 
+# type keeps the regression about one type for any countries.
+REGRESSION_TYPE = "INFP-T"
+
+# The stages of the analysis, in the order they run: the GNI per capita 
+# statistics, the most and least common personality types, the graphs and 
+# the regression of the most common type against the average GNI per capita
+STAGES = ("gni", "pers", "charts", "regression")
+
+# The columns of the files that hold notes rather than numbers (the footnote 
+# letters of GNI_FILE) and are dropped by load_country_table. Every other 
+# column is kept, even when it has no numbers, so a year with no data is a 
+# column of NaN rather than missing from the table.
+NON_NUMERIC_COLUMNS = ("Info",)
+
 def read_in_file(filename):
     """
     Read in file and return a nested lst.
@@ -103,6 +222,430 @@ def read_in_file(filename):
         
     return file_lines
 
+def _parse_row(row, width, flat_values):
+    """
+    Add the numeric cells of one row of a file to flat_values, padding short
+    rows and cutting long rows to the width of the header. Cells that are 
+    not numbers are added as NaN. 
+    
+    Parameters
+    ---
+    row: lst
+        The row from the csv reader, starting with the country name.
+    width: int
+        The number of numeric columns in the header.
+    flat_values: array
+        The flat buffer of doubles to add the values to.
+    
+    Returns
+    ---
+    country_name: str
+        The name of the country of the row.
+    """
+    cells = row[1:width + 1]
+    cells.extend([""] * (width - len(cells)))
+    for cell in cells:
+        try:
+            flat_values.append(float(cell))
+        except ValueError:
+            flat_values.append(np.nan)
+            
+    return row[0].strip()
+
+def load_country_table(filename):
+    """
+    Read in file once and return it as a CountryTable, converting every 
+    numeric cell to a float64 as it is read. 
+    
+    The byte order mark at the start of GNI_FILE is removed from the header 
+    and the columns in NON_NUMERIC_COLUMNS (like the Info column of 
+    GNI_FILE, which only holds footnote letters) are dropped. Every other 
+    column is kept, with NaN for its missing values. 
+    
+    Parameters
+    ---
+    filename: str
+        Name of the file.
+    
+    Returns
+    ---
+    country_table: CountryTable
+        The countries, column labels and 2d array of values of the file.
+    """
+    # Create an empty lst for the countries and a flat buffer of doubles for 
+    # the values, so no cell is kept around as a Python object
+    countries = []
+    flat_values = array.array("d")
+    
+    # Open the file with utf-8-sig so the byte order mark is removed
+    with open(filename, "r", encoding="utf-8-sig", newline="") as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=",")
+        header = next(csv_reader)
+        width = len(header) - 1
+        
+        # Iterate over each row and add its values to the buffer
+        for row in csv_reader:
+            if row:
+                countries.append(_parse_row(row, width, flat_values))
+    
+    # Turn the buffer into a 2d array without copying it
+    values = np.frombuffer(flat_values, dtype=np.float64)
+    values = values.reshape(len(countries), width)
+    
+    # Drop the columns that hold notes rather than numbers
+    columns = np.array([label.strip() for label in header[1:]], dtype=str)
+    keep = ~np.isin(columns, NON_NUMERIC_COLUMNS)
+    if not keep.all():
+        values = values[:, keep]
+        columns = columns[keep]
+    
+    return CountryTable(np.array(countries, dtype=str), columns, 
+                        np.ascontiguousarray(values))
+
+def _source_signature(filename, with_hash=True):
+    """
+    Get the size, modification time and (optionally) the sha256 hash of the 
+    contents of a file, which together tell whether the file has changed.
+    
+    Parameters
+    ---
+    filename: str
+        Name of the file.
+    with_hash: bool, optional
+        Whether to read the whole file to hash its contents.
+    
+    Returns
+    ---
+    signature: dictionary
+        A dictionary with the keys "size", "mtime_ns" and "sha256". The hash
+        is '' when with_hash is False.
+    """
+    file_stat = os.stat(filename)
+    signature = {"size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns,
+                 "sha256": ""}
+    
+    if with_hash:
+        file_hash = hashlib.sha256()
+        with open(filename, "rb") as source_file:
+            for block in iter(lambda: source_file.read(1 << 20), b""):
+                file_hash.update(block)
+        signature["sha256"] = file_hash.hexdigest()
+        
+    return signature
+
+def cache_paths(filename, cache_dir=None):
+    """
+    Get the paths of the two cache files for a file: a .npy file with the 
+    2d array of values (which can be memory-mapped) and a .npz file with the 
+    country and column labels and the signature of the file they came from.
+    
+    Parameters
+    ---
+    filename: str
+        Name of the file.
+    cache_dir: str, optional
+        The directory to keep the cache in. The default is the directory of 
+        the file.
+    
+    Returns
+    ---
+    values_path: str
+        The path of the cache file of the values.
+    labels_path: str
+        The path of the cache file of the labels and signature.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(filename))
+    cache_base = os.path.join(cache_dir, os.path.basename(filename))
+    
+    return cache_base + ".cache.npy", cache_base + ".cache.npz"
+
+def _write_cache(country_table, signature, values_path, labels_path):
+    """
+    Write a CountryTable and the signature of its file into the cache files.
+    Each file is written under a temporary name and then renamed, so other 
+    processes never read a half-written cache. The labels file is written 
+    last because it holds the signature that makes the cache valid.
+    """
+    temp_suffix = ".tmp{}".format(os.getpid())
+    
+    with open(values_path + temp_suffix, "wb") as values_file:
+        np.save(values_file, np.ascontiguousarray(country_table.values))
+    os.replace(values_path + temp_suffix, values_path)
+    
+    with open(labels_path + temp_suffix, "wb") as labels_file:
+        np.savez(labels_file, countries=country_table.countries, 
+                 columns=country_table.columns, 
+                 shape=np.array(country_table.values.shape), 
+                 size=np.int64(signature["size"]), 
+                 mtime_ns=np.int64(signature["mtime_ns"]), 
+                 sha256=np.array(signature["sha256"]), 
+                 non_numeric=np.array(NON_NUMERIC_COLUMNS, dtype=str))
+    os.replace(labels_path + temp_suffix, labels_path)
+
+def load_country_table_cached(filename, cache_dir=None, verify_hash=True, 
+                              mmap_mode=None):
+    """
+    Load a file as a CountryTable from its binary cache, reading in the CSV 
+    file with load_country_table (and writing the cache) only when there is 
+    no cache yet or the file has changed since the cache was written. 
+    
+    The cache is invalid when the size or modification time of the file 
+    changed, when it was written with other NON_NUMERIC_COLUMNS and, when 
+    verify_hash is True, when the sha256 hash of its contents changed. 
+    Hashing still reads the whole file but is much faster than parsing it. 
+    
+    Parameters
+    ---
+    filename: str
+        Name of the file.
+    cache_dir: str, optional
+        The directory to keep the cache in. The default is the directory of 
+        the file.
+    verify_hash: bool, optional
+        Whether to also compare the hash of the contents of the file. The 
+        default is True.
+    mmap_mode: str, optional
+        If given (like "r"), the values are memory-mapped from the cache 
+        instead of read into memory, see np.load. 
+    
+    Returns
+    ---
+    country_table: CountryTable
+        The countries, column labels and 2d array of values of the file.
+    """
+    values_path, labels_path = cache_paths(filename, cache_dir)
+    signature = _source_signature(filename, with_hash=verify_hash)
+    
+    # Use the cache if its signature matches the file
+    try:
+        with np.load(labels_path, allow_pickle=False) as labels:
+            cache_is_valid = (
+                int(labels["size"]) == signature["size"] 
+                and int(labels["mtime_ns"]) == signature["mtime_ns"]
+                and (tuple(labels["non_numeric"].tolist()) 
+                     == tuple(NON_NUMERIC_COLUMNS))
+                and (not verify_hash 
+                     or str(labels["sha256"]) == signature["sha256"]))
+            if cache_is_valid:
+                values = np.load(values_path, mmap_mode=mmap_mode, 
+                                 allow_pickle=False)
+                if values.shape == tuple(labels["shape"]):
+                    return CountryTable(labels["countries"], 
+                                        labels["columns"], values)
+    except (OSError, KeyError, ValueError):
+        pass
+    
+    # Otherwise read in the file and write the cache for the next time
+    country_table = load_country_table(filename)
+    if not verify_hash:
+        signature = _source_signature(filename, with_hash=True)
+    try:
+        _write_cache(country_table, signature, values_path, labels_path)
+    except OSError:
+        return country_table
+    
+    # Map the values from the cache that was just written when asked to
+    if mmap_mode is not None:
+        country_table = country_table._replace(
+            values=np.load(values_path, mmap_mode=mmap_mode))
+        
+    return country_table
+
+def load_shared_tables(gni_file=os.path.join(DATA_DIR, GNI_FILE), 
+                       pers_file=os.path.join(DATA_DIR, PERSONALITY_FILE), 
+                       cache_dir=None, verify_hash=True):
+    """
+    Load GNI_FILE and PERSONALITY_FILE as read-only memory-mapped 
+    CountryTables. All the processes that map the same cache files share one
+    physical copy of the values, so worker processes should call this 
+    (for example as the initializer of a multiprocessing.Pool) instead of 
+    reading in the files themselves. 
+    
+    Call it once in the parent process before starting the workers, so the 
+    cache is written once and the workers can pass verify_hash=False.
+
+    Parameters
+    ----------
+    gni_file : str, optional
+        Name of the GNI per capita file. The default is GNI_FILE in DATA_DIR.
+    pers_file : str, optional
+        Name of the personality file. The default is PERSONALITY_FILE in 
+        DATA_DIR.
+    cache_dir : str, optional
+        The directory to keep the cache in. The default is the directory of 
+        each file.
+    verify_hash : bool, optional
+        Whether to also compare the hash of the contents of each file. The 
+        default is True.
+
+    Returns
+    -------
+    gni_table : CountryTable
+        The GNI_FILE with read-only memory-mapped values.
+    pers_table : CountryTable
+        The PERSONALITY_FILE with read-only memory-mapped values.
+    """
+    gni_table = load_country_table_cached(gni_file, cache_dir, verify_hash, 
+                                          mmap_mode="r")
+    pers_table = load_country_table_cached(pers_file, cache_dir, verify_hash,
+                                           mmap_mode="r")
+    
+    return gni_table, pers_table
+
+def iter_country_chunks(filename, chunk_size=10000):
+    """
+    Read in file a chunk of rows at a time and yield each chunk as a 
+    CountryTable, so only chunk_size rows are ever held in memory. Like 
+    load_country_table, the columns in NON_NUMERIC_COLUMNS are dropped, so 
+    each chunk has the same columns as the whole file loaded at once.
+    
+    Parameters
+    ---
+    filename: str
+        Name of the file.
+    chunk_size: int, optional
+        The largest number of rows in each chunk.
+    
+    Yields
+    ---
+    country_chunk: CountryTable
+        The countries, column labels and 2d array of values of the next 
+        chunk_size rows of the file.
+    
+    Raises
+    ---
+    ValueError
+        If chunk_size is less than 1.
+    """
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1, not {}"
+                         .format(chunk_size))
+    
+    with open(filename, "r", encoding="utf-8-sig", newline="") as csv_file:
+        csv_reader = csv.reader(csv_file, delimiter=",")
+        header = next(csv_reader)
+        width = len(header) - 1
+        columns = np.array([label.strip() for label in header[1:]], dtype=str)
+        keep = ~np.isin(columns, NON_NUMERIC_COLUMNS)
+        
+        def make_chunk(countries, flat_values):
+            values = np.frombuffer(flat_values, dtype=np.float64)
+            values = values.reshape(len(countries), width)
+            if not keep.all():
+                values = np.ascontiguousarray(values[:, keep])
+            return CountryTable(np.array(countries, dtype=str), 
+                                columns[keep], values)
+        
+        countries = []
+        flat_values = array.array("d")
+        for row in csv_reader:
+            if not row:
+                continue
+            countries.append(_parse_row(row, width, flat_values))
+            
+            # Yield the chunk once it is full and start a new one
+            if len(countries) == chunk_size:
+                yield make_chunk(countries, flat_values)
+                countries = []
+                flat_values = array.array("d")
+        
+        # Yield the last chunk, which can be smaller than chunk_size
+        if countries:
+            yield make_chunk(countries, flat_values)
+
+def stream_country_means(filename, chunk_size=10000):
+    """
+    Calculate the mean of all the values of each country (like its average 
+    GNI per capita) while streaming the file in chunks. A country can have 
+    any number of rows (one per month or per survey, for example) spread 
+    over the file; all of them count towards its mean. Missing values are 
+    left out.
+    
+    Parameters
+    ---
+    filename: str
+        Name of the file.
+    chunk_size: int, optional
+        The largest number of rows read into memory at once.
+    
+    Returns
+    ---
+    country_means: dictionary
+        A dictionary with the country name as the key and the mean of its 
+        values as the value, or NaN if the country has no values.
+    """
+    # Keep a running sum and count of the values of each country
+    country_sums = {}
+    country_counts = {}
+    
+    for chunk in iter_country_chunks(filename, chunk_size):
+        # Add up the values of each row and then of each country in the chunk
+        has_data = ~np.isnan(chunk.values)
+        row_sums = np.where(has_data, chunk.values, 0.0).sum(axis=1)
+        row_counts = has_data.sum(axis=1)
+        names, inverse = np.unique(chunk.countries, return_inverse=True)
+        chunk_sums = np.bincount(inverse, weights=row_sums, 
+                                 minlength=len(names))
+        chunk_counts = np.bincount(inverse, weights=row_counts, 
+                                   minlength=len(names))
+        
+        for name, total, count in zip(names.tolist(), chunk_sums, 
+                                      chunk_counts):
+            country_sums[name] = country_sums.get(name, 0.0) + total
+            country_counts[name] = country_counts.get(name, 0) + int(count)
+    
+    country_means = {name: (country_sums[name] / country_counts[name] 
+                            if country_counts[name] else np.nan)
+                     for name in country_sums}
+    
+    return country_means
+
+def stream_column_means(filename, chunk_size=10000):
+    """
+    Calculate the mean of each column (like the mean share of each 
+    personality type) over all the rows while streaming the file in chunks.
+    Missing values are left out.
+    
+    Parameters
+    ---
+    filename: str
+        Name of the file.
+    chunk_size: int, optional
+        The largest number of rows read into memory at once.
+    
+    Returns
+    ---
+    column_means: dictionary
+        A dictionary with the column label as the key and the mean of the 
+        column as the value, or NaN if the column has no values.
+    """
+    column_sums = None
+    column_counts = None
+    
+    for chunk in iter_country_chunks(filename, chunk_size):
+        has_data = ~np.isnan(chunk.values)
+        chunk_sums = np.where(has_data, chunk.values, 0.0).sum(axis=0)
+        chunk_counts = has_data.sum(axis=0)
+        
+        # Start the running sums with the first chunk and add the others
+        if column_sums is None:
+            columns = chunk.columns
+            column_sums = chunk_sums
+            column_counts = chunk_counts
+        else:
+            column_sums += chunk_sums
+            column_counts += chunk_counts
+    
+    if column_sums is None:
+        return {}
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        means = np.where(column_counts > 0, column_sums / column_counts, 
+                         np.nan)
+    
+    return dict(zip(columns.tolist(), means.tolist()))
+
 def get_header_lst(nested_lst):
     """
     Pop off the lst with the headers from the nested_lst and return it as a 
@@ -125,10 +668,107 @@ def get_header_lst(nested_lst):
         
     return header_lst
 
-def get_specific_country(nested_lst, country_name):
+def normalize_country_name(country_name):
+    """
+    Normalize a country name so that the same country is always looked up 
+    under the same key, regardless of case, stray whitespace or the byte 
+    order mark at the start of a file.
+    
+    Parameters
+    ---
+    country_name: str
+        Name of the country.
+    
+    Returns
+    ---
+    normalized_name: str
+        The normalized name of the country.
+    """
+    # Remove the byte order mark, collapse the whitespace and ignore the case
+    normalized_name = " ".join(country_name.lstrip("\ufeff").split())
+    
+    return normalized_name.casefold()
+
+def normalize_aliases(aliases):
+    """
+    Normalize both sides of an alias table like COUNTRY_ALIASES, for 
+    country_key.
+    
+    Parameters
+    ---
+    aliases: dictionary
+        A dictionary with the other name of a country as the key and its 
+        name in GNI_FILE as the value.
+    
+    Returns
+    ---
+    alias_keys: dictionary
+        The same dictionary with every name normalized.
+    """
+    return {normalize_country_name(alias): normalize_country_name(name) 
+            for alias, name in aliases.items()}
+
+def country_key(country_name, alias_keys=None):
+    """
+    Get the key a country is indexed and joined under: its normalized name, 
+    or the normalized name it is an alias of.
+    
+    Parameters
+    ---
+    country_name: str
+        Name of the country.
+    alias_keys: dictionary, optional
+        The alias table from normalize_aliases. The default is no aliases.
+    
+    Returns
+    ---
+    key: str
+        The key of the country.
+    """
+    key = normalize_country_name(country_name)
+    if alias_keys:
+        key = alias_keys.get(key, key)
+        
+    return key
+
+def build_country_index(country_names, alias_keys=None):
+    """
+    Build an index that maps each normalized country name to its row offset,
+    so that a country can be looked up without scanning every row. 
+    
+    Parameters
+    ---
+    country_names: iterable
+        The name of the country for each row, in row order. For a nested lst 
+        this is the first cell of each row.
+    alias_keys: dictionary, optional
+        The alias table from normalize_aliases. When given, each country is 
+        indexed under its country_key, so it can be looked up by any of its 
+        names. The default is no aliases.
+    
+    Returns
+    ---
+    country_index: dictionary
+        A dictionary with the normalized country name as the key and the row 
+        offset as the value. 
+    """
+    # Create an empty dictionary 
+    country_index = {}
+    
+    # Iterate over each name and keep the offset of the first row with that 
+    # name, so a repeated name never hides the row that came first
+    for offset, name in enumerate(country_names):
+        country_index.setdefault(country_key(name, alias_keys), offset)
+        
+    return country_index
+
+def get_specific_country(nested_lst, country_name, country_index=None):
     """
     Get the lst for the GNI per capita for specific country.
     
+    The country is matched on its exact (normalized) name, so "Niger" does 
+    not return the row for "Nigeria". 
+    
     Parameters
     ---
     nested_lst: 2d_lst
@@ -136,27 +776,134 @@ def get_specific_country(nested_lst, country_name):
         
     country_name: str
         Name of the country. 
+        
+    country_index: dictionary, optional
+        The index of the nested_lst from build_country_index. Pass it in when 
+        looking up many countries so the index is only built once per file.
+    
+    Returns
+    ---
+    lst_for_country: lst
+        A copy of the row for the country without the empty cells, or an 
+        empty lst if the country is not in the nested_lst.
     """
-    # Create an empty lst 
-    lst_for_country = []
+    # Build the index if one was not given
+    if country_index is None:
+        country_index = build_country_index(row[0] for row in nested_lst)
     
-    # Iterate over each row in the nested lst 
-    for row in nested_lst:
-        
-        # Iterate over the data in reach row to check to see the country_name 
-        # wanted is in row, if it is, set the row as lst_for_country
-        for data in row:
-            if country_name in data:
-                lst_for_country = row 
-                
-    # Iterate over each index in the lst_for_country and check to see if the
-    # index is '', if it is then pop it from the lst.  
-    for indx in range(len(lst_for_country)):
-        if lst_for_country[indx] == '':
-            lst_for_country.pop(indx)
+    # Look up the row offset of the country
+    offset = country_index.get(normalize_country_name(country_name))
+    if offset is None:
+        return []
+    
+    # Copy the row without the cells that are '' so the nested_lst is not 
+    # changed
+    lst_for_country = [data for data in nested_lst[offset] if data != '']
     
     return lst_for_country
 
+def get_countries(nested_lst, country_index, country_names):
+    """
+    Get the lst for each of the countries in country_names.
+    
+    Parameters
+    ---
+    nested_lst: 2d_lst
+        A nested lst of the data for each country. 
+    country_index: dictionary
+        The index of the nested_lst from build_country_index.
+    country_names: iterable
+        Names of the countries.
+    
+    Returns
+    ---
+    country_lsts: 2d_lst
+        The lst for each country in the same order as country_names. 
+    """
+    return [get_specific_country(nested_lst, name, country_index) 
+            for name in country_names]
+
+def select_countries(country_table, country_names, country_index=None, 
+                     alias_keys=None):
+    """
+    Get the rows of the country_table for each of the countries in 
+    country_names as a new CountryTable. A country that is not in the 
+    country_table gets a row of NaN. 
+    
+    Parameters
+    ---
+    country_table: CountryTable
+        A file loaded with load_country_table.
+    country_names: iterable
+        Names of the countries.
+    country_index: dictionary, optional
+        The index of the country_table from build_country_index, built with 
+        the same alias_keys.
+    alias_keys: dictionary, optional
+        The alias table from normalize_aliases, so a country can be found 
+        under any of its names. The default is no aliases.
+    
+    Returns
+    ---
+    selected_table: CountryTable
+        The rows for the countries in the same order as country_names.
+    found: array
+        True for each country that is in the country_table.
+    """
+    if country_index is None:
+        country_index = build_country_index(country_table.countries, 
+                                            alias_keys)
+    
+    # Look up the row offset of each country, using -1 for the missing ones
+    country_names = list(country_names)
+    offsets = np.array([country_index.get(country_key(name, alias_keys), -1)
+                        for name in country_names], dtype=np.intp)
+    found = offsets >= 0
+    
+    # Take all the rows at once and fill the missing countries with NaN
+    values = country_table.values[np.where(found, offsets, 0)]
+    values[~found] = np.nan
+    
+    selected_table = CountryTable(np.array(country_names, dtype=str), 
+                                  country_table.columns, values)
+    
+    return selected_table, found
+
+def select_type_shares(pers_table, country_names, pers_type):
+    """
+    Get the share of one personality type in each of the countries, finding
+    countries under any of their names in COUNTRY_ALIASES.
+    
+    Parameters
+    ---
+    pers_table: CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    country_names: iterable
+        Names of the countries.
+    pers_type: str
+        A personality type like "INFP-T".
+    
+    Returns
+    ---
+    type_shares: array
+        The share of the type in each country, NaN for a country that is 
+        not in the pers_table.
+    
+    Raises
+    ---
+    KeyError
+        If the personality type is not in the pers_table.
+    """
+    columns = pers_table.columns.tolist()
+    if pers_type not in columns:
+        raise KeyError("{!r} is not a personality type".format(pers_type))
+    
+    pers_rows, _ = select_countries(
+        pers_table, country_names, 
+        alias_keys=normalize_aliases(COUNTRY_ALIASES))
+    
+    return pers_rows.values[:, columns.index(pers_type)]
+
 def make_dctn(lst_of_data):
     """
     Convert the lst for each country into a dictionary for the country. The
@@ -219,55 +966,77 @@ def calc_average_gni(data_dctn):
     
     return round(average_gni, 4) 
 
-def combine_into_lst(avg_1, avg_2, avg_3, avg_4, avg_5, avg_6, avg_7, avg_8,
-                   avg_9, avg_10):
+def calc_gni_stats(gni_table):
+    """
+    Calculate the mean, median, min, max, standard deviation and compound 
+    annual growth rate (CAGR) of the GNI per capita from years 1990-2018 for 
+    every country in the gni_table at once. 
+    
+    Missing years are NaN and are left out of each country's statistics. The 
+    CAGR is taken between the first and last year that the country has data 
+    for. A country without any data gets NaN for every statistic.
+    
+    Parameters
+    ---
+    gni_table: CountryTable
+        The GNI_FILE loaded with load_country_table.
+    
+    Returns
+    ---
+    gni_stats: dictionary
+        A dictionary with the key "Country" for the array of countries and 
+        the keys "Average_GNI", "Median_GNI", "Min_GNI", "Max_GNI", 
+        "Std_GNI" and "CAGR" for the arrays of each statistic, in the same 
+        order as the countries.
+    """
+    values = gni_table.values
+    years = np.asarray(gni_table.columns, dtype=np.float64)
+    
+    # Find the first and last year with data for each country
+    has_data = ~np.isnan(values)
+    any_data = has_data.any(axis=1)
+    first_col = has_data.argmax(axis=1)
+    last_col = values.shape[1] - 1 - has_data[:, ::-1].argmax(axis=1)
+    rows = np.arange(values.shape[0])
+    first_gni = values[rows, first_col]
+    last_gni = values[rows, last_col]
+    num_years = years[last_col] - years[first_col]
+    
+    # Countries without data make numpy warn about empty slices, they get 
+    # NaN for every statistic instead 
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            gni_stats = {
+                "Country": gni_table.countries,
+                "Average_GNI": np.nanmean(values, axis=1),
+                "Median_GNI": np.nanmedian(values, axis=1),
+                "Min_GNI": np.nanmin(values, axis=1),
+                "Max_GNI": np.nanmax(values, axis=1),
+                "Std_GNI": np.nanstd(values, axis=1),
+                "CAGR": np.where(any_data & (num_years > 0), 
+                                 (last_gni / first_gni) ** (1 / num_years) - 1,
+                                 np.nan),
+                }
+    
+    return gni_stats
+
+def combine_into_lst(*values):
     """
-    Add the 10 average GNIs per capita into a lst. 
+    Add any number of values (like the average GNIs per capita of each 
+    country) into a lst. 
 
     Parameters
     ----------
-    avg_1 : float
-        An average GNI per capita value.
-    avg_2 : float
-        An average GNI per capita value.
-    avg_3 : float
-        An average GNI per capita value.
-    avg_4 : float
-        An average GNI per capita value.
-    avg_5 : float
-        An average GNI per capita value.
-    avg_6 : float
-        An average GNI per capita value.
-    avg_7 : float
-        An average GNI per capita value.
-    avg_8 : float
-        An average GNI per capita value.
-    avg_9 : float
-        An average GNI per capita value.
-    avg_10 : float
-        An average GNI per capita value.
+    *values : any
+        The values to add, in order.
 
     Returns
     -------
     lst of values: lst
         A lst of all the values in the parameter.
     """
-    # Create an empty lst
-    lst_of_values = []
-    
-    # Add each item to lst 
-    lst_of_values.append(avg_1)
-    lst_of_values.append(avg_2)
-    lst_of_values.append(avg_3)
-    lst_of_values.append(avg_4)
-    lst_of_values.append(avg_5)
-    lst_of_values.append(avg_6)
-    lst_of_values.append(avg_7)
-    lst_of_values.append(avg_8)
-    lst_of_values.append(avg_9)
-    lst_of_values.append(avg_10)
-                                           
-    return lst_of_values 
+    return list(values)
     
 def combine_into_nested_lst(percentages_lst):
     """
@@ -471,25 +1240,1578 @@ def pers_headers(pers_lst, pers_header, highest_pers, lowest_pers):
     
     return highest_pers_type, lowest_pers_type
 
-def print_gni_data(country_name, average_gni):
+def rank_pers_types(pers_table, k=1):
     """
-    Print the gni_data in the specific format.
+    Find the k most common and k least common personality types for every 
+    country in the pers_table at once. The pers_table is not changed, so it 
+    is safe to rank the same rows any number of times.
 
     Parameters
     ----------
-    country_name : str
-        Name of country. 
-    average_gni : float
-        Average_gni per capita value for each country. 
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    k : int, optional
+        The number of most and least common types to find for each country.
+        The default is 1.
 
     Returns
     -------
-    None.
+    pers_ranks : dictionary
+        A dictionary with the key "Country" for the array of countries and 
+        the keys "Top_Types", "Top_Pct", "Bottom_Types" and "Bottom_Pct" for 
+        2d arrays with k columns. The top types go from the most common down
+        and the bottom types go from the least common up.
     """
-    print("The average GNI per capita for {} is ${}."
-          .format(country_name, average_gni))
-    
-    return 
+    values = pers_table.values
+    k = max(1, min(k, values.shape[1]))
+    rows = np.arange(values.shape[0])[:, np.newaxis]
+    
+    # Partition each row so the k largest (or smallest) percentages come 
+    # first and then only sort those k columns
+    top_cols = np.argpartition(-values, k - 1, axis=1)[:, :k]
+    top_cols = np.take_along_axis(
+        top_cols, np.argsort(-values[rows, top_cols], axis=1), axis=1)
+    bottom_cols = np.argpartition(values, k - 1, axis=1)[:, :k]
+    bottom_cols = np.take_along_axis(
+        bottom_cols, np.argsort(values[rows, bottom_cols], axis=1), axis=1)
+    
+    pers_ranks = {
+        "Country": pers_table.countries,
+        "Top_Types": pers_table.columns[top_cols],
+        "Top_Pct": values[rows, top_cols],
+        "Bottom_Types": pers_table.columns[bottom_cols],
+        "Bottom_Pct": values[rows, bottom_cols],
+        }
+    
+    return pers_ranks
+
+def run_country_pipeline(countries, gni_table, pers_table, profiler=None):
+    """
+    Find the average GNI per capita and the most and least common 
+    personality types for each of the countries in one batched pass over 
+    both files. 
+
+    Parameters
+    ----------
+    countries : iterable or str
+        Names of the countries, or "all" for every country in GNI_FILE.
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    profiler : StageProfiler, optional
+        Times the "extract", "gni_average" and "pers_extremes" stages. The 
+        default is None, for no profiling.
+
+    Returns
+    -------
+    result_table : lst
+        A lst of dictionaries, one for each country, that look like:
+            {'Country': 'Canada', 'Average_GNI': 37334.2759, 
+             'Most_Common_Type': 'INFP-T', 'Most_Common_Pct': 0.1275, 
+             'Least_Common_Type': 'ESTP-T', 'Least_Common_Pct': 0.0079}
+        A value is None when the country is missing from that file.
+        
+    Raises
+    ------
+    KeyError
+        If a country is in neither of the files.
+    """
+    if isinstance(countries, str) and countries == "all":
+        countries = gni_table.countries
+    # Both files are searched for the countries, so a generator can only be 
+    # read once
+    countries = list(countries)
+    
+    # Take the rows for the countries out of both files, finding countries 
+    # that are spelled differently in the two files through COUNTRY_ALIASES
+    with profile_stage(profiler, "extract"):
+        alias_keys = normalize_aliases(COUNTRY_ALIASES)
+        gni_rows, gni_found = select_countries(gni_table, countries, 
+                                               alias_keys=alias_keys)
+        pers_rows, pers_found = select_countries(pers_table, countries, 
+                                                 alias_keys=alias_keys)
+    
+    missing = gni_rows.countries[~gni_found & ~pers_found]
+    if len(missing):
+        raise KeyError("Countries not found in either file: {}"
+                       .format(", ".join(missing)))
+    
+    # Calculate the statistics for all the countries at once
+    with profile_stage(profiler, "gni_average"):
+        average_gni = calc_gni_stats(gni_rows)["Average_GNI"]
+    with profile_stage(profiler, "pers_extremes"):
+        pers_ranks = rank_pers_types(pers_rows, k=1)
+    
+    # Create a dictionary for each country
+    result_table = []
+    for i, country in enumerate(gni_rows.countries):
+        has_pers = pers_found[i] and not np.isnan(pers_ranks["Top_Pct"][i, 0])
+        this_dict = {
+            "Country": str(country),
+            "Average_GNI": (round(float(average_gni[i]), 4) 
+                            if gni_found[i] and not np.isnan(average_gni[i]) 
+                            else None),
+            "Most_Common_Type": (str(pers_ranks["Top_Types"][i, 0]) 
+                                 if has_pers else None),
+            "Most_Common_Pct": (float(pers_ranks["Top_Pct"][i, 0]) 
+                                if has_pers else None),
+            "Least_Common_Type": (str(pers_ranks["Bottom_Types"][i, 0]) 
+                                  if has_pers else None),
+            "Least_Common_Pct": (float(pers_ranks["Bottom_Pct"][i, 0]) 
+                                 if has_pers else None),
+            }
+        result_table.append(this_dict)
+    
+    return result_table
+
+"""
+A CountryJoin holds the two files lined up by country: the names of the 
+countries in both files (as written in GNI_FILE), a CountryTable of each 
+file with just those countries in the same order, the row of each of them 
+in each file, and the names of the rows of each file that have no match in 
+the other (like the regions and "World" in GNI_FILE).
+"""
+CountryJoin = namedtuple("CountryJoin", ["countries", "gni", "pers", 
+                                         "gni_offsets", "pers_offsets", 
+                                         "unmatched_gni", "unmatched_pers"])
+
+def join_country_tables(gni_table, pers_table, aliases=None):
+    """
+    Line the two files up by country with a hash join: the personality 
+    countries are put in a dictionary under their country_key once, then 
+    every row of the GNI file is looked up in it, so joining every country 
+    takes one pass over each file.
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    aliases : dictionary, optional
+        The other names of countries, like COUNTRY_ALIASES. The default is 
+        COUNTRY_ALIASES; pass {} to only match names that are the same.
+
+    Returns
+    -------
+    joined : CountryJoin
+        The countries in both files in the order of the gni_table (the 
+        first row of a repeated country is used) and the unmatched rows.
+    """
+    alias_keys = normalize_aliases(COUNTRY_ALIASES if aliases is None 
+                                   else aliases)
+    pers_index = build_country_index(pers_table.countries, alias_keys)
+    
+    gni_offsets = []
+    pers_offsets = []
+    unmatched_gni = []
+    seen = set()
+    for gni_offset, name in enumerate(gni_table.countries):
+        key = country_key(name, alias_keys)
+        if key in seen:
+            continue
+        seen.add(key)
+        
+        pers_offset = pers_index.get(key)
+        if pers_offset is None:
+            unmatched_gni.append(gni_offset)
+        else:
+            gni_offsets.append(gni_offset)
+            pers_offsets.append(pers_offset)
+    
+    gni_offsets = np.array(gni_offsets, dtype=np.intp)
+    pers_offsets = np.array(pers_offsets, dtype=np.intp)
+    matched_pers = np.zeros(len(pers_table.countries), dtype=bool)
+    matched_pers[pers_offsets] = True
+    
+    countries = gni_table.countries[gni_offsets]
+    
+    return CountryJoin(
+        countries, 
+        CountryTable(countries, gni_table.columns, 
+                     gni_table.values[gni_offsets]), 
+        CountryTable(countries, pers_table.columns, 
+                     pers_table.values[pers_offsets]), 
+        gni_offsets, pers_offsets, 
+        gni_table.countries[np.array(unmatched_gni, dtype=np.intp)], 
+        pers_table.countries[~matched_pers])
+
+def join_on_country(gni_table, pers_table, aliases=None):
+    """
+    Find the countries that are in both files and the row of each of them 
+    in each file, with join_country_tables. 
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    aliases : dictionary, optional
+        The other names of countries. The default is COUNTRY_ALIASES.
+
+    Returns
+    -------
+    countries : array
+        The names of the countries that are in both files, as they are 
+        written in the gni_table.
+    gni_offsets : array
+        The row of each country in the gni_table.
+    pers_offsets : array
+        The row of each country in the pers_table.
+    """
+    joined = join_country_tables(gni_table, pers_table, aliases)
+    
+    return joined.countries, joined.gni_offsets, joined.pers_offsets
+
+def correlate_columns(x_values, y_values):
+    """
+    Calculate the correlation of every column of x_values with y_values at 
+    once, using matrix operations instead of fitting one model per column. 
+    Rows with a missing value in y_values or in any column of x_values are 
+    left out.
+
+    Parameters
+    ----------
+    x_values : 2d array
+        One row per country and one column per feature (like the share of 
+        each personality type).
+    y_values : array
+        One value per country (like the average GNI per capita).
+
+    Returns
+    -------
+    correlations : dictionary
+        A dictionary with an array of one value per column for each of the 
+        keys "Pearson_R", "Pearson_P", "Spearman_R", "Spearman_P", "Slope", 
+        "Intercept" and "R2", and the number of countries used under "N". 
+        The p-values are two-sided and come from the t distribution with 
+        N - 2 degrees of freedom.
+    """
+    x_values = np.asarray(x_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    
+    # Only use the rows that have every value
+    keep = ~np.isnan(y_values) & ~np.isnan(x_values).any(axis=1)
+    x_values = x_values[keep]
+    y_values = y_values[keep]
+    num_rows = len(y_values)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Pearson correlation, slope and intercept from the centered values
+        x_mean = x_values.mean(axis=0)
+        y_mean = y_values.mean()
+        x_centered = x_values - x_mean
+        y_centered = y_values - y_mean
+        x_sum_sq = (x_centered ** 2).sum(axis=0)
+        y_sum_sq = (y_centered ** 2).sum()
+        cross = x_centered.T @ y_centered
+        pearson_r = cross / np.sqrt(x_sum_sq * y_sum_sq)
+        slope = cross / x_sum_sq
+        
+        # Spearman correlation is the Pearson correlation of the ranks
+        from scipy import stats
+        
+        x_ranks = stats.rankdata(x_values, axis=0) - (num_rows + 1) / 2
+        y_ranks = stats.rankdata(y_values) - (num_rows + 1) / 2
+        spearman_r = (x_ranks.T @ y_ranks) / np.sqrt(
+            (x_ranks ** 2).sum(axis=0) * (y_ranks ** 2).sum())
+    
+    correlations = {
+        "Pearson_R": pearson_r,
+        "Pearson_P": _correlation_p_value(pearson_r, num_rows),
+        "Spearman_R": spearman_r,
+        "Spearman_P": _correlation_p_value(spearman_r, num_rows),
+        "Slope": slope,
+        "Intercept": y_mean - slope * x_mean,
+        "R2": pearson_r ** 2,
+        "N": num_rows,
+        }
+    
+    return correlations
+
+def _correlation_p_value(r_values, num_rows):
+    """
+    Get the two-sided p-value of each correlation in r_values from the t 
+    distribution with num_rows - 2 degrees of freedom.
+    """
+    from scipy import special
+    
+    dof = num_rows - 2
+    if dof < 1:
+        return np.full(np.shape(r_values), np.nan)
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        r_values = np.clip(r_values, -1.0, 1.0)
+        t_values = r_values * np.sqrt(dof / (1.0 - r_values ** 2))
+        
+    return 2 * special.stdtr(dof, -np.abs(t_values))
+
+def correlate_pers_with_gni(gni_table, pers_table):
+    """
+    Correlate the share of every personality type with the average GNI per 
+    capita of the countries that are in both files, in one matrix operation.
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+
+    Returns
+    -------
+    correlations : dictionary
+        The dictionary from correlate_columns with the personality types 
+        added under the key "Type".
+    """
+    joined = join_country_tables(gni_table, pers_table)
+    average_gni = calc_gni_stats(joined.gni)["Average_GNI"]
+    
+    correlations = correlate_columns(joined.pers.values, average_gni)
+    correlations["Type"] = pers_table.columns
+    
+    return correlations
+
+def type_indicator_matrix(pers_types):
+    """
+    Parse personality types like "INFP-T" into a matrix with a 1 where a 
+    type has a pole of TYPE_POLES, so the shares of the poles can be added 
+    up for every country with one matrix multiplication.
+
+    Parameters
+    ----------
+    pers_types : iterable
+        The personality types, like the columns of the PERSONALITY_FILE 
+        CountryTable.
+
+    Returns
+    -------
+    indicator : array
+        A float64 array with a row for each type and a column for each pole 
+        of TYPE_POLES.
+        
+    Raises
+    ------
+    ValueError
+        If a type is not four letters, a dash and a fifth letter, or has a 
+        letter that is not a pole of its axis.
+    """
+    pers_types = [str(pers_type) for pers_type in pers_types]
+    indicator = np.zeros((len(pers_types), len(TYPE_POLES)))
+    
+    for row, pers_type in enumerate(pers_types):
+        if len(pers_type) != 6 or pers_type[4] != "-":
+            raise ValueError("Not a personality type: {!r}".format(pers_type))
+        letters = pers_type.replace("-", "")
+        for col, (position, letter, _) in enumerate(TYPE_POLES):
+            if letters[position] == letter:
+                indicator[row, col] = 1.0
+        
+        # Every type has exactly one pole on each of the five axes
+        if indicator[row].sum() != 5:
+            raise ValueError("Not a personality type: {!r}".format(pers_type))
+    
+    return indicator
+
+def project_type_axes(pers_table):
+    """
+    Work out the share of every country on each pole of TYPE_POLES (the 
+    share of Introverts, Intuitives, Turbulent types and so on) by adding up
+    the shares of the types that have that pole, for all the countries in 
+    one matrix multiplication. The two poles of an axis add up to the total 
+    of the country's shares (about 1).
+
+    Parameters
+    ----------
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+
+    Returns
+    -------
+    axes_table : CountryTable
+        A CountryTable with the same countries as the pers_table and a 
+        column for each pole, labelled with its name ("Introvert", ...). A 
+        country with a missing share gets NaN on every pole.
+    """
+    indicator = type_indicator_matrix(pers_table.columns)
+    pole_names = np.array([name for _, _, name in TYPE_POLES], dtype=str)
+    
+    return CountryTable(pers_table.countries, pole_names, 
+                        pers_table.values @ indicator)
+
+def correlate_axes_with_gni(gni_table, pers_table):
+    """
+    Correlate the share of every pole of TYPE_POLES with the average GNI 
+    per capita of the countries that are in both files.
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+
+    Returns
+    -------
+    correlations : dictionary
+        The dictionary from correlate_columns with the names of the poles 
+        added under the key "Pole".
+    """
+    joined = join_country_tables(gni_table, pers_table)
+    average_gni = calc_gni_stats(joined.gni)["Average_GNI"]
+    axes_table = project_type_axes(joined.pers)
+    
+    correlations = correlate_columns(axes_table.values, average_gni)
+    correlations["Pole"] = axes_table.columns
+    
+    return correlations
+
+def _fit_path(x_train, y_train, model, alphas):
+    """
+    Fit a ridge or lasso regression for every alpha at once on standardized 
+    values. Ridge uses one singular value decomposition of x_train for all 
+    the alphas and lasso follows its regularization path with warm starts 
+    and a precomputed Gram matrix.
+    
+    Returns the coefficients (one row per alpha) on the original scale of 
+    x_train and the intercepts (one per alpha).
+    """
+    # Standardize the columns and the target so the alphas do not depend on
+    # the units of GNI per capita or the size of the shares
+    x_mean = x_train.mean(axis=0)
+    x_std = x_train.std(axis=0)
+    x_std[x_std == 0] = 1.0
+    y_mean = y_train.mean()
+    y_std = y_train.std() or 1.0
+    x_scaled = (x_train - x_mean) / x_std
+    y_scaled = (y_train - y_mean) / y_std
+    
+    if model == "ridge":
+        u_matrix, singular, vt_matrix = np.linalg.svd(x_scaled, 
+                                                      full_matrices=False)
+        shrink = singular / (singular ** 2 + alphas[:, np.newaxis])
+        coefs = (shrink * (u_matrix.T @ y_scaled)) @ vt_matrix
+    elif model == "lasso":
+        from sklearn.linear_model import lasso_path
+        
+        _, path_coefs, _ = lasso_path(x_scaled, y_scaled, alphas=alphas, 
+                                      precompute=x_scaled.T @ x_scaled, 
+                                      max_iter=10000)
+        coefs = path_coefs.T
+    else:
+        raise ValueError("model must be 'ridge' or 'lasso', not {!r}"
+                         .format(model))
+    
+    # Go back to the original scale
+    coefs = coefs * y_std / x_std
+    intercepts = y_mean - coefs @ x_mean
+    
+    return coefs, intercepts
+
+def _fold_r2(task):
+    """
+    Fit one cross-validation fold for every alpha and return the R^2 of each
+    alpha on the held out countries. The task is a tuple of (x_values, 
+    y_values, test_rows, model, alphas).
+    """
+    x_values, y_values, test_rows, model, alphas = task
+    train = np.ones(len(y_values), dtype=bool)
+    train[test_rows] = False
+    
+    coefs, intercepts = _fit_path(x_values[train], y_values[train], model, 
+                                  alphas)
+    y_test = y_values[test_rows]
+    predictions = x_values[test_rows] @ coefs.T + intercepts
+    residual = ((y_test[:, np.newaxis] - predictions) ** 2).sum(axis=0)
+    
+    return 1.0 - residual / ((y_test - y_test.mean()) ** 2).sum()
+
+def cross_validate_gni_model(gni_table, pers_table, model="ridge", 
+                             alphas=None, n_folds=5, seed=0, processes=1):
+    """
+    Regress the average GNI per capita on the shares of all the personality 
+    types with ridge or lasso regression, choosing alpha by k-fold 
+    cross-validation, to see how much of the GNI per capita the personality
+    mix explains. 
+    
+    The design matrix is built once for the countries that are in both 
+    files. Each fold fits every alpha in one go, and the folds can run in 
+    parallel.
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    model : str, optional
+        "ridge" or "lasso". The default is "ridge".
+    alphas : array, optional
+        The regularization strengths to try, for standardized shares and 
+        GNI. The default is 13 values from 0.001 to 1000 for ridge and 
+        from 0.001 to 1 for lasso.
+    n_folds : int, optional
+        The number of folds. The default is 5.
+    seed : int, optional
+        The seed for shuffling the countries into folds. The default is 0.
+    processes : int, optional
+        The number of worker processes for the folds. The default is 1 and 
+        None uses the number of CPUs.
+
+    Returns
+    -------
+    cv_result : dictionary
+        A dictionary with the keys:
+            "Model", "Alphas", "N" - the model, alphas and number of 
+                countries used,
+            "CV_R2" - the mean R^2 on the held out folds for each alpha,
+            "CV_R2_Folds" - the R^2 of each fold (rows) for each alpha,
+            "Best_Alpha", "Best_CV_R2" - the alpha with the best mean R^2,
+            "Type", "Coef", "Intercept", "Train_R2" - the personality types
+                and the model fitted on all countries with the best alpha.
+            
+    Raises
+    ------
+    ValueError
+        If n_folds is less than 2 or more than the number of countries.
+    """
+    if alphas is None:
+        alphas = (np.logspace(-3, 3, 13) if model == "ridge" 
+                  else np.logspace(-3, 0, 13))
+    # The lasso path goes from the largest alpha down
+    alphas = np.sort(np.asarray(alphas, dtype=np.float64))[::-1]
+    
+    # Build the design matrix once
+    joined = join_country_tables(gni_table, pers_table)
+    y_values = calc_gni_stats(joined.gni)["Average_GNI"]
+    x_values = joined.pers.values
+    keep = ~np.isnan(y_values) & ~np.isnan(x_values).any(axis=1)
+    x_values = np.ascontiguousarray(x_values[keep])
+    y_values = y_values[keep]
+    if not 2 <= n_folds <= len(y_values):
+        raise ValueError("n_folds must be from 2 to the number of countries "
+                         "({}), not {}".format(len(y_values), n_folds))
+    
+    # Shuffle the countries into folds
+    rng = np.random.default_rng(seed)
+    folds = np.array_split(rng.permutation(len(y_values)), n_folds)
+    tasks = [(x_values, y_values, test_rows, model, alphas) 
+             for test_rows in folds]
+    
+    processes = _resolve_processes(processes)
+    if processes == 1 or len(tasks) < 2:
+        fold_r2 = [_fold_r2(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            fold_r2 = list(executor.map(_fold_r2, tasks))
+    fold_r2 = np.array(fold_r2)
+    cv_r2 = fold_r2.mean(axis=0)
+    best = int(np.argmax(cv_r2))
+    
+    # Fit the best alpha on all the countries
+    coefs, intercepts = _fit_path(x_values, y_values, model, 
+                                  alphas[best:best + 1])
+    predictions = x_values @ coefs[0] + intercepts[0]
+    train_r2 = 1.0 - (((y_values - predictions) ** 2).sum() 
+                      / ((y_values - y_values.mean()) ** 2).sum())
+    
+    cv_result = {
+        "Model": model,
+        "Alphas": alphas,
+        "N": len(y_values),
+        "CV_R2": cv_r2,
+        "CV_R2_Folds": fold_r2,
+        "Best_Alpha": float(alphas[best]),
+        "Best_CV_R2": float(cv_r2[best]),
+        "Type": pers_table.columns,
+        "Coef": coefs[0],
+        "Intercept": float(intercepts[0]),
+        "Train_R2": float(train_r2),
+        }
+    
+    return cv_result
+
+def _resample_batch(task):
+    """
+    Compute the correlation of every column of x_values with y_values for 
+    one batch of bootstrap or permutation replicates. All the replicates of 
+    the batch are drawn as one matrix of row indices and correlated at once.
+    The task is a tuple of (x_values, y_values, kind, num_reps, seed_seq) 
+    and the result has one row per replicate and one column per column of 
+    x_values.
+    """
+    x_values, y_values, kind, num_reps, seed_seq = task
+    rng = np.random.default_rng(seed_seq)
+    num_rows = len(y_values)
+    
+    if kind == "bootstrap":
+        # Draw the countries of each replicate with replacement
+        rows = rng.integers(0, num_rows, size=(num_reps, num_rows))
+        x_sample = x_values[rows]
+        y_sample = y_values[rows]
+        x_sample = x_sample - x_sample.mean(axis=1, keepdims=True)
+        y_sample = y_sample - y_sample.mean(axis=1, keepdims=True)
+        cross = np.einsum("bnp,bn->bp", x_sample, y_sample)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return cross / np.sqrt((x_sample ** 2).sum(axis=1) 
+                                   * (y_sample ** 2).sum(axis=1, 
+                                                         keepdims=True))
+    
+    # Shuffle y_values in each replicate; standardizing first turns every 
+    # correlation into one matrix multiply
+    x_scaled = (x_values - x_values.mean(axis=0)) / x_values.std(axis=0)
+    y_scaled = (y_values - y_values.mean()) / y_values.std()
+    rows = rng.permuted(np.tile(np.arange(num_rows), (num_reps, 1)), axis=1)
+    
+    return (y_scaled[rows] @ x_scaled) / num_rows
+
+def resample_correlations(x_values, y_values, n_boot=10000, n_perm=10000, 
+                          seed=0, batch_size=500, ci=0.95, processes=1):
+    """
+    Test the correlation of every column of x_values with y_values with 
+    bootstrap confidence intervals and permutation p-values. The replicates 
+    are drawn in batches that are each correlated with one matrix 
+    operation, and the batches can run in parallel. Every batch has its own 
+    seed from seed, so the result is the same for any number of processes.
+    Rows with a missing value are left out.
+
+    Parameters
+    ----------
+    x_values : 2d array
+        One row per country and one column per feature (like the share of 
+        each personality type).
+    y_values : array
+        One value per country (like the average GNI per capita).
+    n_boot : int, optional
+        The number of bootstrap replicates. The default is 10000.
+    n_perm : int, optional
+        The number of permutation replicates. The default is 10000.
+    seed : int, optional
+        The seed of the random number generator. The default is 0.
+    batch_size : int, optional
+        The number of replicates in each batch. The default is 500.
+    ci : float, optional
+        The level of the bootstrap confidence interval. The default is 0.95.
+    processes : int, optional
+        The number of worker processes. The default is 1 and None uses the 
+        number of CPUs.
+
+    Returns
+    -------
+    resample_result : dictionary
+        A dictionary with one value per column for each of the keys:
+            "R" - the correlation of all the countries,
+            "Boot_SE" - the standard error of the bootstrap replicates,
+            "CI_Low", "CI_High" - the percentile confidence interval,
+            "Perm_P" - the two-sided permutation p-value,
+        the number of countries used under "N", and the replicates 
+        themselves under "Boot_R" and "Perm_R".
+    """
+    x_values = np.asarray(x_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    keep = ~np.isnan(y_values) & ~np.isnan(x_values).any(axis=1)
+    x_values = np.ascontiguousarray(x_values[keep])
+    y_values = y_values[keep]
+    
+    # Split the replicates into batches that each get their own seed
+    tasks = []
+    for stream, (kind, num_reps) in enumerate((("bootstrap", n_boot), 
+                                               ("permutation", n_perm))):
+        batch_sizes = [min(batch_size, num_reps - start) 
+                       for start in range(0, num_reps, batch_size)]
+        seed_seqs = np.random.SeedSequence([seed, stream]).spawn(
+            len(batch_sizes))
+        tasks.extend((x_values, y_values, kind, size, seed_seq) 
+                     for size, seed_seq in zip(batch_sizes, seed_seqs))
+    
+    processes = _resolve_processes(processes)
+    if processes == 1 or len(tasks) < 2:
+        batches = [_resample_batch(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            batches = list(executor.map(_resample_batch, tasks))
+    
+    num_columns = x_values.shape[1]
+    boot_batches = [batch for task, batch in zip(tasks, batches) 
+                    if task[2] == "bootstrap"]
+    perm_batches = [batch for task, batch in zip(tasks, batches) 
+                    if task[2] == "permutation"]
+    boot_r = (np.concatenate(boot_batches) if boot_batches 
+              else np.empty((0, num_columns)))
+    perm_r = (np.concatenate(perm_batches) if perm_batches 
+              else np.empty((0, num_columns)))
+    
+    observed_r = correlate_columns(x_values, y_values)["Pearson_R"]
+    tail = (1.0 - ci) / 2 * 100
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        resample_result = {
+            "R": observed_r,
+            "Boot_SE": np.nanstd(boot_r, axis=0, ddof=1),
+            "CI_Low": np.nanpercentile(boot_r, tail, axis=0),
+            "CI_High": np.nanpercentile(boot_r, 100 - tail, axis=0),
+            "Perm_P": ((np.abs(perm_r) >= np.abs(observed_r) - 1e-12)
+                       .sum(axis=0) + 1) / (len(perm_r) + 1),
+            "N": len(y_values),
+            "Boot_R": boot_r,
+            "Perm_R": perm_r,
+            }
+    
+    return resample_result
+
+def resample_pers_gni_correlation(gni_table, pers_table, types=None, 
+                                  **resample_options):
+    """
+    Run resample_correlations for the share of each personality type 
+    against the average GNI per capita of the countries in both files.
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    types : lst, optional
+        The personality types to test, like ["INFP-T"]. The default is all 
+        of them.
+    **resample_options
+        Passed on to resample_correlations (n_boot, n_perm, seed, 
+        batch_size, ci, processes).
+
+    Returns
+    -------
+    resample_result : dictionary
+        The dictionary from resample_correlations with the personality types
+        added under the key "Type".
+    """
+    joined = join_country_tables(gni_table, pers_table)
+    average_gni = calc_gni_stats(joined.gni)["Average_GNI"]
+    
+    # Pick out the columns of the personality types to test
+    columns = pers_table.columns
+    if types is not None:
+        type_index = {label: indx for indx, label in enumerate(columns)}
+        unknown = [label for label in types if label not in type_index]
+        if unknown:
+            raise KeyError("Unknown personality types: {}"
+                           .format(", ".join(unknown)))
+        column_offsets = [type_index[label] for label in types]
+    else:
+        column_offsets = list(range(len(columns)))
+    
+    x_values = joined.pers.values[:, column_offsets]
+    resample_result = resample_correlations(x_values, average_gni, 
+                                            **resample_options)
+    resample_result["Type"] = columns[column_offsets]
+    
+    return resample_result
+
+def gni_rolling_mean(gni_table, window=5, min_periods=1):
+    """
+    Calculate the rolling mean of the GNI per capita over the years for 
+    every country at once, keeping the country x year layout. The mean for 
+    a year covers that year and the window - 1 years before it, leaving out
+    missing years.
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    window : int, optional
+        The number of years in each mean. The default is 5.
+    min_periods : int, optional
+        The least number of years with data for a mean; with fewer the mean 
+        is NaN. The default is 1.
+
+    Returns
+    -------
+    rolling_table : CountryTable
+        A CountryTable with the same countries and years as the gni_table 
+        and the rolling means as its values.
+    """
+    values = gni_table.values
+    has_data = ~np.isnan(values)
+    
+    # Running sums along the years give the sum and count of every window 
+    # with two subtractions
+    padding = np.zeros((values.shape[0], 1))
+    value_sums = np.concatenate(
+        [padding, np.cumsum(np.where(has_data, values, 0.0), axis=1)], axis=1)
+    count_sums = np.concatenate(
+        [padding, np.cumsum(has_data, axis=1)], axis=1)
+    ends = np.arange(1, values.shape[1] + 1)
+    starts = np.maximum(ends - window, 0)
+    window_sums = value_sums[:, ends] - value_sums[:, starts]
+    window_counts = count_sums[:, ends] - count_sums[:, starts]
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        rolling = np.where(window_counts >= max(min_periods, 1), 
+                           window_sums / window_counts, np.nan)
+    
+    return gni_table._replace(values=rolling)
+
+def gni_growth(gni_table):
+    """
+    Calculate the year-over-year growth of the GNI per capita of every 
+    country at once, as a fraction (0.02 is 2% growth). 
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+
+    Returns
+    -------
+    growth_table : CountryTable
+        A CountryTable with the same countries as the gni_table and one 
+        column for every year after the first, which is NaN when either 
+        year is missing.
+    """
+    values = gni_table.values
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = values[:, 1:] / values[:, :-1] - 1.0
+        
+    return gni_table._replace(columns=gni_table.columns[1:], values=growth)
+
+def correlate_pers_with_gni_by_year(gni_table, pers_table):
+    """
+    Correlate the share of every personality type with the GNI per capita 
+    of every year, for the countries in both files, to see how each 
+    relationship changed over time. Each year uses the countries that have 
+    data for that year, and all the years are done at once with masked 
+    matrix products instead of one pass per year.
+
+    Parameters
+    ----------
+    gni_table : CountryTable
+        The GNI_FILE (or a table from gni_rolling_mean or gni_growth).
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+
+    Returns
+    -------
+    year_correlations : dictionary
+        A dictionary with the keys:
+            "Year" - the years (the columns of the gni_table),
+            "Type" - the personality types,
+            "Pearson_R" - the correlation for each year (rows) and type 
+                (columns),
+            "N" - the number of countries used for each year.
+    """
+    joined = join_country_tables(gni_table, pers_table)
+    gni_values = joined.gni.values
+    pers_values = joined.pers.values
+    
+    # Leave out the countries with missing personality data
+    complete = ~np.isnan(pers_values).any(axis=1)
+    gni_values = gni_values[complete]
+    pers_values = pers_values[complete]
+    
+    # Each sum over the countries with data for a year is a product of the 
+    # year mask with the values
+    mask = (~np.isnan(gni_values)).astype(np.float64)
+    gni_values = np.where(mask > 0, gni_values, 0.0)
+    counts = mask.sum(axis=0)
+    sum_x = mask.T @ pers_values
+    sum_xx = mask.T @ pers_values ** 2
+    sum_y = gni_values.sum(axis=0)
+    sum_yy = (gni_values ** 2).sum(axis=0)
+    sum_xy = gni_values.T @ pers_values
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        counts_col = counts[:, np.newaxis]
+        cov = sum_xy - sum_x * sum_y[:, np.newaxis] / counts_col
+        var_x = sum_xx - sum_x ** 2 / counts_col
+        var_y = sum_yy - sum_y ** 2 / counts
+        pearson_r = cov / np.sqrt(var_x * var_y[:, np.newaxis])
+    pearson_r[counts < 3] = np.nan
+    
+    year_correlations = {
+        "Year": gni_table.columns,
+        "Type": pers_table.columns,
+        "Pearson_R": pearson_r,
+        "N": counts.astype(int),
+        }
+    
+    return year_correlations
+
+def _prepare_distance_values(values, metric):
+    """
+    Scale the rows of values for a metric of DISTANCE_METRICS: to a length 
+    of 1 for "cosine" and to a sum of 1 for "jensen-shannon". Rows with a 
+    missing value stay NaN.
+    """
+    if metric not in DISTANCE_METRICS:
+        raise ValueError("Unknown metric {!r}, use one of {}"
+                         .format(metric, ", ".join(DISTANCE_METRICS)))
+    
+    values = np.asarray(values, dtype=np.float64)
+    if metric == "cosine":
+        totals = np.linalg.norm(values, axis=1, keepdims=True)
+    else:
+        totals = values.sum(axis=1, keepdims=True)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return values / totals
+
+def _plogp(values):
+    """
+    Get values * log2(values), with 0 where a value is 0.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(values > 0, values * np.log2(values), 0.0)
+
+def _distances_from(prepared, rows, metric):
+    """
+    Work out the distances from the rows of prepared (from 
+    _prepare_distance_values) to every row, a block of rows at a time.
+    """
+    rows = np.asarray(rows, dtype=np.intp)
+    num_rows, num_cols = prepared.shape
+    
+    if metric == "cosine":
+        distances = 1.0 - prepared[rows] @ prepared.T
+        return np.clip(distances, 0.0, 2.0, out=distances)
+    
+    # The Jensen-Shannon divergence of p and q is H(m) - (H(p) + H(q)) / 2 
+    # with m their average, so only H(m) depends on the pair. Work it out 
+    # for blocks of rows, keeping each (block x rows x types) array small.
+    sum_plogp = _plogp(prepared).sum(axis=1)
+    block_size = max(1, 2 ** 22 // max(1, num_rows * num_cols))
+    distances = np.empty((len(rows), num_rows))
+    for start in range(0, len(rows), block_size):
+        block = rows[start:start + block_size]
+        mixed = (prepared[block][:, None, :] + prepared[None, :, :]) / 2
+        divergence = ((sum_plogp[block][:, None] + sum_plogp[None, :]) / 2 
+                      - _plogp(mixed).sum(axis=2))
+        distances[start:start + len(block)] = np.sqrt(
+            np.clip(divergence, 0.0, 1.0))
+    
+    return distances
+
+def pairwise_distances(values, metric="cosine", rows=None):
+    """
+    Work out the distances between the rows of values, like the personality
+    profiles of the countries. "cosine" is 1 minus the cosine similarity of 
+    two rows; "jensen-shannon" is the Jensen-Shannon distance (base 2, so 
+    between 0 and 1) of the two rows scaled to add up to 1.
+
+    Parameters
+    ----------
+    values : array
+        A 2d array with a row for each country, like the values of the 
+        PERSONALITY_FILE CountryTable.
+    metric : str, optional
+        "cosine" or "jensen-shannon". The default is "cosine".
+    rows : iterable, optional
+        The rows to work out the distances from. The default is every row, 
+        for the full distance matrix.
+
+    Returns
+    -------
+    distances : array
+        A 2d array with the distance from each of the rows (rows) to every 
+        row (columns). Distances to or from a row with a missing value are 
+        NaN.
+        
+    Raises
+    ------
+    ValueError
+        If the metric is not one of DISTANCE_METRICS.
+    """
+    prepared = _prepare_distance_values(values, metric)
+    if rows is None:
+        rows = np.arange(len(prepared))
+    
+    return _distances_from(prepared, rows, metric)
+
+def _kmeans_run(task):
+    """
+    Run one restart of k-means (Lloyd's algorithm from a k-means++ start) 
+    on the rows of values. The task is a tuple of (values, k, seed_seq, 
+    max_iter) and the result is a tuple of (k, inertia, labels), where the 
+    inertia is the sum of the squared distances of the rows to the centre 
+    of their cluster.
+    """
+    values, k, seed_seq, max_iter = task
+    rng = np.random.default_rng(seed_seq)
+    num_rows = len(values)
+    sq_norms = np.einsum("ij,ij->i", values, values)
+    
+    # k-means++: pick each new centre with a probability proportional to 
+    # the squared distance to the closest centre picked so far
+    centers = np.empty((k, values.shape[1]))
+    centers[0] = values[rng.integers(num_rows)]
+    closest = ((values - centers[0]) ** 2).sum(axis=1)
+    for center in range(1, k):
+        total = closest.sum()
+        pick = (rng.choice(num_rows, p=closest / total) if total > 0 
+                else rng.integers(num_rows))
+        centers[center] = values[pick]
+        closest = np.minimum(closest, 
+                             ((values - centers[center]) ** 2).sum(axis=1))
+    
+    labels = None
+    rows = np.arange(num_rows)
+    for _ in range(max_iter):
+        distances = (sq_norms[:, None] - 2 * values @ centers.T 
+                     + (centers ** 2).sum(axis=1))
+        new_labels = distances.argmin(axis=1)
+        if labels is not None and np.array_equal(new_labels, labels):
+            break
+        labels = new_labels
+        
+        # Move every centre to the mean of its rows, and an empty cluster's 
+        # centre to the rows farthest from their own centres
+        members = np.zeros((k, num_rows))
+        members[labels, rows] = 1.0
+        counts = members.sum(axis=1)
+        empty = counts == 0
+        centers[~empty] = (members @ values)[~empty] / counts[~empty, None]
+        if empty.any():
+            farthest = np.argsort(-distances[rows, labels], kind="stable")
+            centers[empty] = values[farthest[:empty.sum()]]
+    
+    distances = (sq_norms[:, None] - 2 * values @ centers.T 
+                 + (centers ** 2).sum(axis=1))
+    labels = distances.argmin(axis=1)
+    inertia = float(np.maximum(distances[rows, labels], 0.0).sum())
+    
+    return k, inertia, labels
+
+def _relabel(labels):
+    """
+    Number the clusters 0, 1, ... in the order their first row appears, so 
+    the same clustering always gets the same labels.
+    """
+    _, first_rows, inverse = np.unique(labels, return_index=True, 
+                                       return_inverse=True)
+    order = np.argsort(np.argsort(first_rows))
+    
+    return order[inverse.ravel()]
+
+def _complete_pers_rows(pers_table):
+    """
+    Get the names and values of the countries of the pers_table without a 
+    missing share.
+    """
+    complete = ~np.isnan(pers_table.values).any(axis=1)
+    
+    return (pers_table.countries[complete], 
+            np.ascontiguousarray(pers_table.values[complete]))
+
+def _inertia(values, labels):
+    """
+    Get the sum of the squared distances of the rows of values to the mean 
+    of their cluster.
+    """
+    inertia = 0.0
+    for label in np.unique(labels):
+        cluster = values[labels == label]
+        inertia += float(((cluster - cluster.mean(axis=0)) ** 2).sum())
+        
+    return inertia
+
+def cluster_kmeans(pers_table, k_values=range(2, 11), n_init=10, seed=0, 
+                   max_iter=300, processes=1):
+    """
+    Cluster the countries by their personality shares with k-means for 
+    every number of clusters in k_values, keeping the best of n_init 
+    restarts for each. The restarts of every k are independent tasks that 
+    can run in parallel, and each has its own seed from seed, so the result 
+    is the same for any number of processes. Countries with a missing share 
+    are left out.
+
+    Parameters
+    ----------
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    k_values : iterable, optional
+        The numbers of clusters to try. The default is 2 to 10.
+    n_init : int, optional
+        The number of restarts for each k. The default is 10.
+    seed : int, optional
+        The seed of the random number generator. The default is 0.
+    max_iter : int, optional
+        The most iterations of a restart. The default is 300.
+    processes : int, optional
+        The number of worker processes. The default is 1 and None uses the 
+        number of CPUs.
+
+    Returns
+    -------
+    clusters : dictionary
+        A dictionary with the keys:
+            "Country" - the countries that were clustered,
+            "K" - the numbers of clusters,
+            "Inertia" - the sum of the squared distances of the countries 
+                to their cluster's centre for each k,
+            "Labels" - the cluster of every country (columns) for each k 
+                (rows).
+    """
+    countries, values = _complete_pers_rows(pers_table)
+    k_values = [k for k in k_values if 1 <= k <= len(values)]
+    
+    tasks = []
+    for k in k_values:
+        seed_seqs = np.random.SeedSequence([seed, k]).spawn(n_init)
+        tasks.extend((values, k, seed_seq, max_iter) 
+                     for seed_seq in seed_seqs)
+    
+    processes = _resolve_processes(processes)
+    if processes == 1 or len(tasks) < 2:
+        runs = [_kmeans_run(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            runs = list(executor.map(
+                _kmeans_run, tasks, 
+                chunksize=max(1, len(tasks) // (4 * processes))))
+    
+    # Keep the restart with the lowest inertia for each k (the first one on 
+    # a tie, so the result does not depend on the order runs finish in)
+    best = {}
+    for k, inertia, labels in runs:
+        if k not in best or inertia < best[k][0]:
+            best[k] = (inertia, labels)
+    
+    clusters = {
+        "Country": countries,
+        "K": np.array(k_values, dtype=int),
+        "Inertia": np.array([best[k][0] for k in k_values]),
+        "Labels": np.array([_relabel(best[k][1]) for k in k_values], 
+                           dtype=int).reshape(len(k_values), len(countries)),
+        }
+    
+    return clusters
+
+def cluster_agglomerative(pers_table, k_values=range(2, 11), 
+                          method="ward"):
+    """
+    Cluster the countries by their personality shares with agglomerative 
+    (hierarchical) clustering. The tree of merges is built once and cut at 
+    every number of clusters in k_values. Countries with a missing share are
+    left out.
+
+    Parameters
+    ----------
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    k_values : iterable, optional
+        The numbers of clusters to cut the tree into. The default is 2 to 
+        10.
+    method : str, optional
+        The linkage method of scipy.cluster.hierarchy.linkage, like "ward", 
+        "average" or "complete". The default is "ward".
+
+    Returns
+    -------
+    clusters : dictionary
+        The same keys as cluster_kmeans, with the tree of merges under 
+        "Linkage".
+    """
+    from scipy.cluster import hierarchy
+    
+    countries, values = _complete_pers_rows(pers_table)
+    k_values = [k for k in k_values if 1 <= k <= len(values)]
+    tree = hierarchy.linkage(values, method=method)
+    
+    labels = [_relabel(hierarchy.fcluster(tree, k, criterion="maxclust")) 
+              for k in k_values]
+    
+    clusters = {
+        "Country": countries,
+        "K": np.array(k_values, dtype=int),
+        "Inertia": np.array([_inertia(values, label) for label in labels]),
+        "Labels": np.array(labels, dtype=int).reshape(len(k_values), 
+                                                      len(countries)),
+        "Linkage": tree,
+        }
+    
+    return clusters
+
+def summarize_clusters(clusters, k, gni_table, pers_table, num_types=3):
+    """
+    Describe each cluster of a clustering from cluster_kmeans or 
+    cluster_agglomerative: its countries, the mean of their average GNI per 
+    capita and its most common personality types.
+
+    Parameters
+    ----------
+    clusters : dictionary
+        The result of cluster_kmeans or cluster_agglomerative.
+    k : int
+        The number of clusters to describe, one of clusters["K"].
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    num_types : int, optional
+        The number of dominant types of each cluster. The default is 3.
+
+    Returns
+    -------
+    summary : lst
+        A dictionary for each cluster that looks like:
+            {'Cluster': 0, 'Size': 42, 'Countries': ['Canada', ...], 
+             'Mean_Average_GNI': 31234.5, 'N_GNI': 40, 
+             'Dominant_Types': [('INFP-T', 0.1204), ...]}
+        where N_GNI is the number of its countries with a GNI per capita 
+        and Dominant_Types are the types with the highest mean share.
+        
+    Raises
+    ------
+    KeyError
+        If the clusters were not made for k.
+    """
+    k_values = clusters["K"].tolist()
+    if k not in k_values:
+        raise KeyError("No clustering with k={}".format(k))
+    labels = clusters["Labels"][k_values.index(k)]
+    countries = clusters["Country"]
+    
+    # The average GNI per capita of every clustered country, matching the 
+    # names across the files through COUNTRY_ALIASES
+    gni_rows, _ = select_countries(
+        gni_table, countries, alias_keys=normalize_aliases(COUNTRY_ALIASES))
+    average_gni = calc_gni_stats(gni_rows)["Average_GNI"]
+    pers_rows, _ = select_countries(pers_table, countries)
+    columns = pers_table.columns
+    
+    summary = []
+    for label in range(labels.max() + 1 if len(labels) else 0):
+        members = labels == label
+        cluster_gni = average_gni[members]
+        cluster_gni = cluster_gni[~np.isnan(cluster_gni)]
+        mean_shares = pers_rows.values[members].mean(axis=0)
+        dominant = np.argsort(-mean_shares, kind="stable")[:num_types]
+        
+        summary.append({
+            "Cluster": label,
+            "Size": int(members.sum()),
+            "Countries": countries[members].tolist(),
+            "Mean_Average_GNI": (float(cluster_gni.mean()) 
+                                 if len(cluster_gni) else None),
+            "N_GNI": len(cluster_gni),
+            "Dominant_Types": [(str(columns[col]), float(mean_shares[col])) 
+                               for col in dominant],
+            })
+    
+    return summary
+
+class CountryDataset:
+    """
+    Both files loaded once, with the statistics that every query needs 
+    worked out up front, for code that asks many questions about the same 
+    data (like a long-running service) instead of running main(). Nothing 
+    here prints, plots or reads a file after the dataset is made.
+    
+    Parameters
+    ----------
+    gni_file : str, optional
+        Name of the GNI per capita file. The default is GNI_FILE next to 
+        this module.
+    pers_file : str, optional
+        Name of the personality file. The default is PERSONALITY_FILE next 
+        to this module.
+    cache : bool, optional
+        Whether to load the files through their binary cache. The default 
+        is True.
+    mmap : bool, optional
+        Whether to memory-map the values from the cache, so that processes 
+        share them. The default is False.
+    aliases : dictionary, optional
+        The other names of countries, which can be used to look them up and 
+        match them across the files. The default is COUNTRY_ALIASES.
+    """
+    
+    def __init__(self, gni_file=None, pers_file=None, cache=True, 
+                 mmap=False, aliases=None):
+        gni_file = gni_file or os.path.join(DATA_DIR, GNI_FILE)
+        pers_file = pers_file or os.path.join(DATA_DIR, PERSONALITY_FILE)
+        
+        if cache:
+            mmap_mode = "r" if mmap else None
+            gni_table = load_country_table_cached(gni_file, 
+                                                  mmap_mode=mmap_mode)
+            pers_table = load_country_table_cached(pers_file, 
+                                                   mmap_mode=mmap_mode)
+        else:
+            gni_table = load_country_table(gni_file)
+            pers_table = load_country_table(pers_file)
+            
+        self._set_tables(gni_table, pers_table, aliases)
+    
+    @classmethod
+    def from_tables(cls, gni_table, pers_table, aliases=None):
+        """
+        Make a CountryDataset from two CountryTables that are already 
+        loaded.
+        """
+        dataset = cls.__new__(cls)
+        dataset._set_tables(gni_table, pers_table, aliases)
+        
+        return dataset
+    
+    def _set_tables(self, gni_table, pers_table, aliases=None):
+        """
+        Keep the tables and work out the indexes, the join of the two files 
+        and the GNI statistics of every country.
+        """
+        aliases = COUNTRY_ALIASES if aliases is None else aliases
+        self.gni_table = gni_table
+        self.pers_table = pers_table
+        self._alias_keys = normalize_aliases(aliases)
+        self.gni_index = build_country_index(gni_table.countries, 
+                                             self._alias_keys)
+        self.pers_index = build_country_index(pers_table.countries, 
+                                              self._alias_keys)
+        self.joined = join_country_tables(gni_table, pers_table, aliases)
+        self._gni_stats = calc_gni_stats(gni_table)
+        self._correlations = None
+        self._neighbours = {}
+        
+    @property
+    def countries(self):
+        """
+        The names of all the countries in either file.
+        """
+        names = list(self.gni_table.countries)
+        names.extend(self.joined.unmatched_pers)
+        
+        return names
+    
+    @property
+    def types(self):
+        """
+        The personality types, in the order of the columns of 
+        PERSONALITY_FILE.
+        """
+        return self.pers_table.columns.tolist()
+    
+    def _offset(self, country_index, country_name, filename):
+        """
+        Get the row of a country, raising a KeyError if it is not there.
+        """
+        offset = country_index.get(country_key(country_name, 
+                                               self._alias_keys))
+        if offset is None:
+            raise KeyError("{!r} is not in {}".format(country_name, filename))
+        
+        return offset
+    
+    def gni_stats(self, country_name=None):
+        """
+        Get the GNI per capita statistics of one country, or of every 
+        country.
+
+        Parameters
+        ----------
+        country_name : str, optional
+            Name of the country. The default is every country.
+
+        Returns
+        -------
+        gni_stats : dictionary
+            For one country, the dictionary of calc_gni_stats with a single 
+            value (a float, or None when missing) for each key. For every 
+            country, the dictionary of calc_gni_stats itself.
+            
+        Raises
+        ------
+        KeyError
+            If the country is not in GNI_FILE.
+        """
+        if country_name is None:
+            return self._gni_stats
+        
+        offset = self._offset(self.gni_index, country_name, GNI_FILE)
+        gni_stats = {"Country": str(self.gni_table.countries[offset])}
+        for key, values in self._gni_stats.items():
+            if key != "Country":
+                value = float(values[offset])
+                gni_stats[key] = None if np.isnan(value) else value
+                
+        return gni_stats
+    
+    def top_types(self, country_name, k=1):
+        """
+        Get the k most and least common personality types of a country.
+
+        Parameters
+        ----------
+        country_name : str
+            Name of the country.
+        k : int, optional
+            The number of types. The default is 1.
+
+        Returns
+        -------
+        top_types : dictionary
+            A dictionary like:
+                {'Country': 'Canada', 'Top': [('INFP-T', 0.1275)], 
+                 'Bottom': [('ESTP-T', 0.0079)]}
+            with the top types from the most common down and the bottom 
+            types from the least common up, ranked by rank_pers_types like 
+            in run_country_pipeline. Types with a missing share are left 
+            out.
+            
+        Raises
+        ------
+        KeyError
+            If the country is not in PERSONALITY_FILE.
+        """
+        offset = self._offset(self.pers_index, country_name, 
+                              PERSONALITY_FILE)
+        pers_row = CountryTable(self.pers_table.countries[offset:offset + 1], 
+                                self.pers_table.columns, 
+                                self.pers_table.values[offset:offset + 1])
+        pers_ranks = rank_pers_types(pers_row, k)
+        
+        top_types = {"Country": str(pers_row.countries[0])}
+        for key in ["Top", "Bottom"]:
+            ranked = zip(pers_ranks[key + "_Types"][0], 
+                         pers_ranks[key + "_Pct"][0])
+            top_types[key] = [(str(pers_type), float(pct)) 
+                              for pers_type, pct in ranked 
+                              if not np.isnan(pct)]
+        
+        return top_types
+    
+    def correlate(self, pers_type=None):
+        """
+        Get the correlation of the share of personality types with the 
+        average GNI per capita. It is worked out the first time it is asked 
+        for and then kept.
+
+        Parameters
+        ----------
+        pers_type : str, optional
+            A personality type like "INFP-T". The default is every type.
+
+        Returns
+        -------
+        correlations : dictionary
+            For one type, the dictionary of correlate_pers_with_gni with a 
+            single value for each key. For every type, the dictionary of 
+            correlate_pers_with_gni itself.
+            
+        Raises
+        ------
+        KeyError
+            If the personality type is not in PERSONALITY_FILE.
+        """
+        if self._correlations is None:
+            # Use the join and the GNI statistics worked out already
+            average_gni = self._gni_stats["Average_GNI"][
+                self.joined.gni_offsets]
+            self._correlations = correlate_columns(self.joined.pers.values, 
+                                                   average_gni)
+            self._correlations["Type"] = self.pers_table.columns
+        if pers_type is None:
+            return self._correlations
+        
+        columns = self.types
+        if pers_type not in columns:
+            raise KeyError("{!r} is not a personality type".format(pers_type))
+        col = columns.index(pers_type)
+        
+        correlations = {}
+        for key, values in self._correlations.items():
+            if np.ndim(values) == 0:
+                correlations[key] = values
+            elif key == "Type":
+                correlations[key] = str(values[col])
+            else:
+                correlations[key] = float(values[col])
+                
+        return correlations
+    
+    def similar_countries(self, country_name, k=5, metric="cosine"):
+        """
+        Find the k countries with the personality profiles closest to a 
+        country's.
+        
+        The first query for a metric works out the distances between every 
+        pair of countries and the order of every country's neighbours, so 
+        each query after it only takes a slice. With more than 
+        FULL_DISTANCE_LIMIT countries only the distances from the country 
+        asked about are worked out, for every query.
+
+        Parameters
+        ----------
+        country_name : str
+            Name of the country.
+        k : int, optional
+            The number of countries. The default is 5.
+        metric : str, optional
+            "cosine" or "jensen-shannon", see pairwise_distances. The 
+            default is "cosine".
+
+        Returns
+        -------
+        similar : lst
+            A tuple of (country, distance) for each country, from the 
+            closest out. Countries with missing personality data are left 
+            out.
+            
+        Raises
+        ------
+        KeyError
+            If the country is not in PERSONALITY_FILE.
+        ValueError
+            If k is less than 1 or the metric is not one of 
+            DISTANCE_METRICS.
+        """
+        if k < 1:
+            raise ValueError("k must be at least 1, not {}".format(k))
+        offset = self._offset(self.pers_index, country_name, 
+                              PERSONALITY_FILE)
+        values = self.pers_table.values
+        
+        if len(values) <= FULL_DISTANCE_LIMIT:
+            if metric not in self._neighbours:
+                distances = pairwise_distances(values, metric)
+                # NaN distances are sorted to the end
+                order = np.argsort(distances, axis=1, kind="stable")
+                self._neighbours[metric] = (distances, order)
+            distances, order = self._neighbours[metric]
+            distances = distances[offset]
+            candidates = order[offset][:k + 1]
+        else:
+            distances = pairwise_distances(values, metric, [offset])[0]
+            distances = np.where(np.isnan(distances), np.inf, distances)
+            candidates = np.argpartition(distances, 
+                                         min(k, len(distances) - 1))[:k + 1]
+            candidates = candidates[np.argsort(distances[candidates], 
+                                               kind="stable")]
+        
+        similar = [(str(self.pers_table.countries[indx]), 
+                    float(distances[indx])) 
+                   for indx in candidates 
+                   if indx != offset and np.isfinite(distances[indx])]
+        
+        return similar[:k]
+
+def print_gni_data(country_name, average_gni):
+    """
+    Print the gni_data in the specific format.
+
+    Parameters
+    ----------
+    country_name : str
+        Name of country. 
+    average_gni : float
+        Average_gni per capita value for each country. 
+
+    Returns
+    -------
+    None.
+    """
+    print("The average GNI per capita for {} is ${}."
+          .format(country_name, average_gni))
+    
+    return 
 
 def print_pers_data(highest_pers_type, highest_pers, 
                            lowest_pers_type, lowest_pers):  
@@ -518,8 +2840,40 @@ def print_pers_data(highest_pers_type, highest_pers,
        
     return  
     
+def _draw_pers_bars(ax, country, personality_type, personality_percentages):
+    """
+    Draw the bar graph of the personality percentages of a country on the 
+    matplotlib Axes ax.
+    """
+    # Build an array for the x-axis; 32 personality types on x-axis
+    personality_type_axis = np.arange(len(personality_type))
+    
+    # Plot graph
+    ax.bar(personality_type_axis, personality_percentages, -0.7, 
+           color=("orange", "red", "pink"))
+     
+    ax.set_xticks(personality_type_axis)
+    ax.set_xticklabels(personality_type, rotation=90)
+    ax.tick_params(axis="x", labelsize=7, labelcolor="black")
+    ax.tick_params(axis="y", labelsize=8, labelcolor="black")
+    ax.set_xlabel("Personality Types")
+    ax.set_ylabel("Percentages")
+    ax.set_title("Personality Distribution in {}".format(country))
+    
+def _draw_gni_bars(ax, countries, average_gni):
+    """
+    Draw the bar graph of the average GNI per capita of each country on the 
+    matplotlib Axes ax.
+    """
+    ax.bar(countries, average_gni, color="green")
+    ax.tick_params(axis="x", labelrotation=45)
+    ax.set_title("Average GNI per capita for each Country")
+    ax.set_xlabel("Countries")
+    ax.set_ylabel("Average GNI per capita ($)") 
+
 def graph_bar_graph_pers(countries, personality_header, 
-                         personality_percentages):
+                         personality_percentages, output_dir=None, 
+                         fmt="png"):
     """
     Plot the bar graphs for each personality percentages and types for each 
     country. 
@@ -532,10 +2886,16 @@ def graph_bar_graph_pers(countries, personality_header,
         List of the headings for each column for the PERSONALITY_FILE.
     personality_percentages: list
         List of personality percentages for each personality type.   
+    output_dir: str, optional
+        If given, the graph is written into this directory (named by 
+        chart_filename) instead of being shown on the screen.
+    fmt: str, optional
+        The image format when writing the graph, "png" or "svg".
         
     Returens
     ---
-    None.
+    path: str or None
+        The path of the graph when output_dir is given, otherwise None.
     """
     # Make list of personality types without header
     personality_type = personality_header[1:]
@@ -545,24 +2905,26 @@ def graph_bar_graph_pers(countries, personality_header,
     for index in range(len(personality_percentages)):
         personality_percentages[index]= float(personality_percentages[index])
     
-    # Build an array for the x-axis; 32 personality types on x-axis
-    personality_type_axis = np.arange(len(personality_type))
+    # Write the graph into a file in report mode
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        return _render_pers_chart(
+            (countries, personality_type, personality_percentages, 
+             os.path.join(output_dir, 
+                          chart_filename("pers", countries, fmt))))
     
     # Plot graph
-    plt.bar(personality_type_axis, personality_percentages, -0.7, 
-            color=("orange", "red", "pink"))
-     
-    plt.xticks(personality_type_axis, personality_type, rotation=90)
-    plt.xticks(fontsize=7,color='black')
-    plt.yticks(fontsize=8,color='black')
-    plt.xlabel("Personality Types")
-    plt.ylabel("Percentages")
-    plt.title("Personality Distribution in {}".format(countries))
+    import matplotlib.pyplot as plt
+    
+    _draw_pers_bars(plt.gca(), countries, personality_type, 
+                    personality_percentages)
     plt.show()
+    plt.close()
   
     return
 
-def graph_bar_gni_data(countries_lst, lst_of_avg_gni):
+def graph_bar_gni_data(countries_lst, lst_of_avg_gni, output_dir=None, 
+                       fmt="png"):
     """
     Plot a bar graph for the countries in the countries_lst with the height of 
     the bars being the average GNI per capita for each country.
@@ -573,33 +2935,57 @@ def graph_bar_gni_data(countries_lst, lst_of_avg_gni):
         List of countries.
     lst_of_avg_gni : TYPE
         List of average GNI per capita values.
+    output_dir : str, optional
+        If given, the graph is written into this directory (named by 
+        chart_filename) instead of being saved as 1.png and shown on the 
+        screen.
+    fmt : str, optional
+        The image format when writing the graph, "png" or "svg".
 
     Returns
     -------
-    None.
+    path : str or None
+        The path of the graph when output_dir is given, otherwise None.
     """
-    # Create variable names for each parameter.
-    countries = countries_lst
-    average_gni = lst_of_avg_gni
-
+    # Write the graph into a file in report mode
+    if output_dir is not None:
+        return render_gni_chart(countries_lst, lst_of_avg_gni, output_dir, 
+                                fmt)
+    
     # Plot graph 
-    plt.bar(countries, average_gni, color="green")
-    plt.xticks(rotation=45)
-    plt.title("Average GNI per capita for each Country")
-    plt.xlabel("Countries")
-    plt.ylabel("Average GNI per capita ($)") 
+    import matplotlib.pyplot as plt
+    
+    _draw_gni_bars(plt.gca(), countries_lst, lst_of_avg_gni)
     
     # Save graph 
     plt.savefig("1.png", bbox_inches='tight')
     plt.show()
+    plt.close()
     
     return
 
-def graph_regression(x_lst, y_lst):
+def _draw_regression(ax, X, y, insample_pred, pers_type=REGRESSION_TYPE):
+    """
+    Draw the points and the regression line of graph_regression on the 
+    matplotlib Axes ax.
+    """
+    # X is a list of list with one value each, so flatten it for plotting
+    x_values = np.ravel(X)
+    
+    ax.scatter(x_values, y, color="orange")
+    ax.plot(x_values, insample_pred, color="purple", linewidth=3)
+    ax.set_title("{} Personality % VS GNI per Capita Regression"
+                 .format(pers_type))
+    ax.set_xlabel("Personality (%)")
+    ax.set_ylabel("GNI per capita ($)")
+
+def graph_regression(x_lst, y_lst, output_dir=None, fmt="png", plot=True, 
+                     pers_type=REGRESSION_TYPE):
     """
     Make a linearRegression graph to find if there is any correlation between 
-    the percentage of INFP-T (most common personality) in each country and the 
-    average Gross National Income per capita in each country.
+    the percentage of a personality type (INFP-T, the most common 
+    personality, by default) in each country and the average Gross National 
+    Income per capita in each country.
 
     Parameters
     ----------
@@ -607,12 +2993,26 @@ def graph_regression(x_lst, y_lst):
         List of list of x-values
     y_lst : list
         List of y-values
+    output_dir : str, optional
+        If given, the graph is written into this directory (named by 
+        chart_filename) instead of being shown on the screen.
+    fmt : str, optional
+        The image format when writing the graph, "png" or "svg".
+    plot : bool, optional
+        Whether to graph the regression at all. With False only the 
+        coefficient is printed. The default is True.
+    pers_type : str, optional
+        The personality type of the x-values, for the title and file name 
+        of the graph. The default is REGRESSION_TYPE.
 
     Returns
     -------
-    None.
+    path : str or None
+        The path of the graph when output_dir is given, otherwise None.
 
     """
+    from sklearn.linear_model import LinearRegression
+    
     # Create the y and X variables 
     y = y_lst
     X = x_lst
@@ -625,19 +3025,172 @@ def graph_regression(x_lst, y_lst):
     model = lr.fit(X, y)
     print("Linear Correlation Coefficient: ",  model.coef_)  
     
+    if not plot:
+        return
+    
     # Create a insample prediction model 
     insample_pred = model.predict(X)
     
+    # Write the graph into a file in report mode
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        path = os.path.join(output_dir, 
+                            chart_filename("regression", pers_type, fmt))
+        from matplotlib.figure import Figure
+        
+        fig = Figure(figsize=(8, 5))
+        _draw_regression(fig.add_subplot(), X, y, insample_pred, pers_type)
+        fig.savefig(path, bbox_inches="tight")
+        return path
+    
     # Plot outputs
-    plt.scatter(X, y, color="orange")
-    plt.plot(X, insample_pred, color="purple", linewidth=3)
-    plt.title("INFP-T Personality % VS GNI per Capita Regression")
-    plt.xlabel("Personality (%)")
-    plt.ylabel("GNI per capita ($)")
+    import matplotlib.pyplot as plt
+    
+    _draw_regression(plt.gca(), X, y, insample_pred, pers_type)
     plt.show()
+    plt.close()
 
     return 
 
+def chart_filename(kind, name, fmt="png"):
+    """
+    Make the file name of a chart from its kind and the name of what it 
+    shows, like "pers_United_States.png", so the same chart always gets the 
+    same name.
+
+    Parameters
+    ----------
+    kind : str
+        The kind of chart, like "pers" or "gni".
+    name : str
+        The name of what the chart shows, like the name of the country.
+    fmt : str, optional
+        The image format, "png" or "svg". The default is "png".
+
+    Returns
+    -------
+    filename : str
+        The file name of the chart.
+    """
+    slug = re.sub(r"[^0-9A-Za-z]+", "_", name).strip("_")
+    
+    return "{}_{}.{}".format(kind, slug, fmt)
+
+def _resolve_processes(processes):
+    """
+    Turn a processes argument into a number of worker processes: None means 
+    the number of CPUs, and there is always at least 1. Work is only sent to
+    a process pool when this is more than 1.
+    """
+    if processes is None:
+        processes = os.cpu_count() or 1
+    
+    return max(1, int(processes))
+
+def _render_pers_chart(task):
+    """
+    Render the personality bar graph of one country into a file with the 
+    object-oriented matplotlib API, which needs no display and shares no 
+    state with other charts, so it can run in any worker process. 
+    
+    The task is a tuple of (country, personality_type, 
+    personality_percentages, path).
+    """
+    from matplotlib.figure import Figure
+    
+    country, personality_type, personality_percentages, path = task
+    
+    fig = Figure(figsize=(8, 5))
+    _draw_pers_bars(fig.add_subplot(), country, personality_type, 
+                    personality_percentages)
+    fig.savefig(path, bbox_inches="tight")
+    
+    return path
+
+def render_pers_charts(countries, pers_table, output_dir, fmt="png", 
+                       processes=None):
+    """
+    Render the personality bar graph of each country into output_dir, 
+    spreading the charts over a pool of processes. Nothing is shown on the 
+    screen, so this works without a display.
+
+    Parameters
+    ----------
+    countries : iterable
+        Names of the countries. Countries that are not in the pers_table are
+        skipped.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    output_dir : str
+        The directory to write the charts into. It is created if needed.
+    fmt : str, optional
+        The image format, "png" or "svg". The default is "png".
+    processes : int, optional
+        The number of worker processes. The default is the number of CPUs 
+        and 1 renders every chart in this process.
+
+    Returns
+    -------
+    chart_paths : lst
+        The paths of the charts that were written, in the order of 
+        countries.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    countries = list(countries)
+    pers_rows, found = select_countries(
+        pers_table, countries, alias_keys=normalize_aliases(COUNTRY_ALIASES))
+    personality_type = pers_rows.columns.tolist()
+    
+    # Make one small task for each country so only its own row is sent to 
+    # the worker
+    tasks = [(country, personality_type, pers_rows.values[i].tolist(), 
+              os.path.join(output_dir, chart_filename("pers", country, fmt)))
+             for i, country in enumerate(countries) if found[i]]
+    
+    processes = _resolve_processes(processes)
+    if processes == 1 or len(tasks) < 2:
+        return [_render_pers_chart(task) for task in tasks]
+    
+    # Send the tasks in a few chunks to each worker to cut the overhead
+    chunksize = max(1, len(tasks) // (4 * processes))
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        chart_paths = list(executor.map(_render_pers_chart, tasks, 
+                                        chunksize=chunksize))
+    
+    return chart_paths
+
+def render_gni_chart(countries_lst, lst_of_avg_gni, output_dir, fmt="png"):
+    """
+    Render the bar graph of the average GNI per capita of each country into 
+    output_dir without showing it on the screen.
+
+    Parameters
+    ----------
+    countries_lst : list
+        List of countries.
+    lst_of_avg_gni : list
+        List of average GNI per capita values.
+    output_dir : str
+        The directory to write the chart into. It is created if needed.
+    fmt : str, optional
+        The image format, "png" or "svg". The default is "png".
+
+    Returns
+    -------
+    path : str
+        The path of the chart.
+    """
+    from matplotlib.figure import Figure
+    
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, chart_filename("gni", "average", fmt))
+    
+    fig = Figure(figsize=(8, 5))
+    _draw_gni_bars(fig.add_subplot(), countries_lst, lst_of_avg_gni)
+    fig.savefig(path, bbox_inches="tight")
+    
+    return path
+
 def print_country_name(country_name):
     """
     Print the country name in the specified format.
@@ -653,242 +3206,549 @@ def print_country_name(country_name):
     """
     print("\n{}:".format(country_name))
     
-def main():
+class StageProfiler:
     """
-    According to the US news, these are the top 10 countries in the world:
-        Canada, Japan, Germany, Switzerland, Australia, United States, 
-        New Zealand, United Kingdom, Sweden, and Netherlands. 
-    This is according to agility, entrepreneurship, quality of life, movers, 
-    social purpose, cultural influence, open for business, power, adventure, 
-    and heritage.
-    """
-    countries_lst = ["Canada", "Japan", "Germany", "Switzerland", 
-                      "Australia", "United States", "New Zealand", 
-                      "United Kingdom", "Sweden", "Netherlands"] 
+    Opt-in timing of the stages of a run: the wall time, CPU time and peak 
+    memory allocated (traced with tracemalloc) of every stage, written out 
+    as JSON lines or in the Chrome trace format (which chrome://tracing and 
+    Perfetto open). Tracing memory slows Python down, so a run is only 
+    profiled when a StageProfiler is passed to it.
     
-    # These are the abbreviations used for each of the 10 countries:
-        # Canada - ca, Japan - jp, Germany - ge, Switzerland - sw, 
-        # Australia - au, United States - us, New Zealand - nz, 
-        # United Kingdom - uk, Sweden - se, Netherlands - nl
-  
-    # Read in the file of the GNI per capita of each country from 
-    # years 1990-2018 as a nested lst.
-    gni_nested_lst = read_in_file(GNI_FILE)
-    
-    # Seperate the nested of the GNI per capita into a lst for each
-    # of the 10 countries. 
-    ca_gni = get_specific_country(gni_nested_lst, "Canada") 
-    jp_gni = get_specific_country(gni_nested_lst, "Japan")
-    ge_gni = get_specific_country(gni_nested_lst, "Germany")
-    sw_gni = get_specific_country(gni_nested_lst, "Switzerland")
-    au_gni = get_specific_country(gni_nested_lst, "Australia")
-    us_gni = get_specific_country(gni_nested_lst, "United States")
-    nz_gni = get_specific_country(gni_nested_lst, "New Zealand")
-    uk_gni = get_specific_country(gni_nested_lst, "United Kingdom")
-    se_gni = get_specific_country(gni_nested_lst, "Sweden")
-    nl_gni = get_specific_country(gni_nested_lst, "Netherlands")
-    
-    # Convert the GNI per capita for each country into a dictionary.
-    ca_dctn = make_dctn(ca_gni)
-    jp_dctn = make_dctn(jp_gni)
-    ge_dctn = make_dctn(ge_gni)
-    sw_dctn = make_dctn(sw_gni)
-    au_dctn = make_dctn(au_gni)
-    us_dctn = make_dctn(us_gni)
-    nz_dctn = make_dctn(nz_gni)
-    uk_dctn = make_dctn(uk_gni)
-    se_dctn = make_dctn(se_gni)
-    nl_dctn = make_dctn(nl_gni) 
-    
-    # Calculate the avergae GNI per capita from years 1990-2018 for each 
-    # country. 
-    ca_average_gni = calc_average_gni(ca_dctn)
-    jp_average_gni = calc_average_gni(jp_dctn)
-    ge_average_gni = calc_average_gni(ge_dctn)
-    sw_average_gni = calc_average_gni(sw_dctn)
-    au_average_gni = calc_average_gni(au_dctn)
-    us_average_gni = calc_average_gni(us_dctn)
-    nz_average_gni = calc_average_gni(nz_dctn)
-    uk_average_gni = calc_average_gni(uk_dctn)
-    se_average_gni = calc_average_gni(se_dctn)
-    nl_average_gni = calc_average_gni(nl_dctn)
-    
-    # Print the avergae GNI per capita for each country
-    print("Here are the average GNI per capita for each country...")
-    print("------------------------")
-    print_gni_data("Canada", round(ca_average_gni, 2))
-    print_gni_data("Japan", round(jp_average_gni, 2))
-    print_gni_data("Germany", round(ge_average_gni, 2))
-    print_gni_data("Switzerland", round(sw_average_gni, 2))
-    print_gni_data("Australia", round(au_average_gni, 2))
-    print_gni_data("United States", round(us_average_gni, 2))
-    print_gni_data("New Zealand", round(nz_average_gni, 2))
-    print_gni_data("United Kingdom", round(uk_average_gni, 2))
-    print_gni_data("Sweden", round(se_average_gni, 2))
-    print_gni_data("Netherlands", round(nl_average_gni, 2))
-    
-    # Make the avg gni per capita for each country into a list.
-    lst_of_avg_gni = combine_into_lst(ca_average_gni, jp_average_gni, 
-                                  ge_average_gni, sw_average_gni,
-                                  au_average_gni, us_average_gni, 
-                                  nz_average_gni, uk_average_gni, 
-                                  se_average_gni, nl_average_gni)
-     
-    # Make a lst of dictionary of the country and the avg_gni
-    country_and_agv_gni_lst = make_country_gni_dctn(countries_lst, 
-                                                     lst_of_avg_gni)
-    
-    # Compare the values in the lst_of_avg_gni to find the value of the 
-    # highest avg GNI per capita and its corresponding country and find the 
-    # value of the lowest avg GNI per capita and its corresponding country. 
-    top_avg_gni, top_country, lowest_avg_gni, low_country = compare_gni_value(
-        country_and_agv_gni_lst)
-    
-    print("\nThese are the highest and lowest GNI per capita...")
-    print("------------------------")
-    print("The highest average GNI per capita is ${} from {}."
-          .format(round(top_avg_gni, 2), top_country))
-    print("The lowest average GNI per capita is ${} from {}."
-          .format(round(lowest_avg_gni, 2), low_country))
-    
-    # Read in the file of the distribution of each personality type in 
-    # each country from PERSONALITY_FILE. 
-    pers_nested_lst = read_in_file(PERSONALITY_FILE) 
-    
-    # Get the header_lst from personality_nested_lst
-    pers_header = get_header_lst(pers_nested_lst)
-
-    # Get the personality_types lst for each of the 10 specific countries 
-    # in the countries lst
-    ca_pers_lst = get_specific_country(pers_nested_lst, "Canada") 
-    jp_pers_lst = get_specific_country(pers_nested_lst, "Japan")
-    ge_pers_lst = get_specific_country(pers_nested_lst, "Germany")
-    sw_pers_lst = get_specific_country(pers_nested_lst, "Switzerland")
-    au_pers_lst = get_specific_country(pers_nested_lst, "Australia")
-    us_pers_lst = get_specific_country(pers_nested_lst, "United States")
-    nz_pers_lst = get_specific_country(pers_nested_lst, "New Zealand")
-    uk_pers_lst = get_specific_country(pers_nested_lst, "United Kingdom")
-    se_pers_lst = get_specific_country(pers_nested_lst, "Sweden")
-    nl_pers_lst = get_specific_country(pers_nested_lst, "Netherlands")
-    
-    # Get highest and lowest personality percentage values for each of 
-    # the 10 countries and then find the matching personality types (headers) 
-    # for each country to determine most common and least common personality 
-    # types for each of the 10 countries.
-    
-    # Canada
-    ca_highest_pers, ca_lowest_pers = compare_pers_value(ca_pers_lst)
-    ca_highest_pers_type, ca_lowest_pers_type = pers_headers(ca_pers_lst, 
-                                                             pers_header, 
-                                                             ca_highest_pers, 
-                                                             ca_lowest_pers)
-    
-    # Japan 
-    jp_highest_pers, jp_lowest_pers = compare_pers_value(jp_pers_lst)
-    jp_highest_pers_type, jp_lowest_pers_type = pers_headers(jp_pers_lst, 
-                                                             pers_header, 
-                                                             jp_highest_pers, 
-                                                             jp_lowest_pers)
-    
-    # Germany 
-    ge_highest_pers, ge_lowest_pers = compare_pers_value(ge_pers_lst)
-    ge_highest_pers_type, ge_lowest_pers_type = pers_headers(ge_pers_lst, 
-                                                             pers_header, 
-                                                             ge_highest_pers, 
-                                                             ge_lowest_pers)
-    
-    # Switzerland
-    sw_highest_pers, sw_lowest_pers = compare_pers_value(sw_pers_lst)
-    sw_highest_pers_type, sw_lowest_pers_type = pers_headers(sw_pers_lst, 
-                                                             pers_header, 
-                                                             sw_highest_pers, 
-                                                             sw_lowest_pers)
-    
-    # Australia
-    au_highest_pers, au_lowest_pers = compare_pers_value(au_pers_lst)
-    au_highest_pers_type, au_lowest_pers_type = pers_headers(au_pers_lst, 
-                                                             pers_header, 
-                                                             au_highest_pers, 
-                                                             au_lowest_pers)
-    
-    # United States 
-    us_highest_pers, us_lowest_pers = compare_pers_value(us_pers_lst)
-    us_highest_pers_type, us_lowest_pers_type = pers_headers(us_pers_lst, 
-                                                             pers_header, 
-                                                             us_highest_pers, 
-                                                             us_lowest_pers)
-    
-    # New Zealand
-    nz_highest_pers, nz_lowest_pers = compare_pers_value(nz_pers_lst)
-    nz_highest_pers_type, nz_lowest_pers_type = pers_headers(nz_pers_lst, 
-                                                             pers_header, 
-                                                             nz_highest_pers, 
-                                                             nz_lowest_pers)
-    
-    # United Kingdom
-    uk_highest_pers, uk_lowest_pers = compare_pers_value(uk_pers_lst)
-    uk_highest_pers_type, uk_lowest_pers_type = pers_headers(uk_pers_lst, 
-                                                             pers_header, 
-                                                             uk_highest_pers, 
-                                                             uk_lowest_pers)
-    
-    # Sweden
-    se_highest_pers, se_lowest_pers = compare_pers_value(se_pers_lst)
-    se_highest_pers_type, se_lowest_pers_type = pers_headers(se_pers_lst, 
-                                                             pers_header, 
-                                                             se_highest_pers, 
-                                                             se_lowest_pers)
-    
-    # Netherlands
-    nl_highest_pers, nl_lowest_pers = compare_pers_value(nl_pers_lst)
-    nl_highest_pers_type, nl_lowest_pers_type = pers_headers(nl_pers_lst, 
-                                                             pers_header, 
-                                                             nl_highest_pers, 
-                                                             nl_lowest_pers)
-       
-    # Print personality data for each country
-    print("\nHere are the personality data for each country...")
-    print("------------------------") 
-    print_country_name("Canada")
-    print_pers_data(ca_highest_pers_type, ca_highest_pers, ca_lowest_pers_type, 
-                    ca_lowest_pers)
-
-    print_country_name("Japan")
-    print_pers_data(jp_highest_pers_type, jp_highest_pers, jp_lowest_pers_type, 
-                    jp_lowest_pers)
+    Stages may be nested; the peak memory of a stage then includes the 
+    stages inside it.
     
-    print_country_name("Germany")
-    print_pers_data(ge_highest_pers_type, ge_highest_pers, ge_lowest_pers_type, 
-                    ge_lowest_pers)
+    Parameters
+    ----------
+    trace_memory : bool, optional
+        Whether to trace the peak memory of each stage. The default is True.
+    """
     
-    print_country_name("Switzerland")
-    print_pers_data(sw_highest_pers_type, sw_highest_pers, sw_lowest_pers_type, 
-                    sw_lowest_pers)
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.records = []
+        self._open = []
+        self._started_tracing = False
+        self._origin = time.perf_counter()
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        """
+        Time the code inside a with block as the stage name.
+        """
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        
+        record = {"stage": name, "depth": len(self._open)}
+        if self.trace_memory:
+            # Keep the peak of the open stages before it is reset for this 
+            # one
+            current, peak = tracemalloc.get_traced_memory()
+            for outer in self._open:
+                outer["_peak"] = max(outer["_peak"], peak)
+            tracemalloc.reset_peak()
+            record["_base"] = record["_peak"] = current
+        self._open.append(record)
+        
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record["start_ms"] = (start_wall - self._origin) * 1000
+            record["wall_ms"] = (time.perf_counter() - start_wall) * 1000
+            record["cpu_ms"] = (time.process_time() - start_cpu) * 1000
+            self._open.pop()
+            
+            if self.trace_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                for open_record in self._open + [record]:
+                    open_record["_peak"] = max(open_record["_peak"], peak)
+                record["peak_bytes"] = (record.pop("_peak") 
+                                        - record.pop("_base"))
+            
+            self.records.append(record)
+    
+    def close(self):
+        """
+        Stop tracing memory if this profiler started it.
+        """
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+    
+    def write(self, output, trace_format="jsonl"):
+        """
+        Write the records of the stages in the order they finished.
+
+        Parameters
+        ----------
+        output : str or file
+            The file to write, or a file object.
+        trace_format : str, optional
+            "jsonl" for one JSON object per stage, with the keys "stage", 
+            "depth", "start_ms", "wall_ms", "cpu_ms" and "peak_bytes", or 
+            "chrome" for the Chrome trace event format. The default is 
+            "jsonl".
+
+        Returns
+        -------
+        None.
+        """
+        if trace_format == "chrome":
+            events = [{"name": record["stage"], "ph": "X", "pid": os.getpid(),
+                       "tid": 0, "ts": record["start_ms"] * 1000, 
+                       "dur": record["wall_ms"] * 1000, 
+                       "args": {key: value for key, value in record.items() 
+                                if key in ("cpu_ms", "peak_bytes")}} 
+                      for record in self.records]
+            text = json.dumps({"traceEvents": events, 
+                               "displayTimeUnit": "ms"}) + "\n"
+        elif trace_format == "jsonl":
+            text = "".join(json.dumps(record) + "\n" 
+                           for record in self.records)
+        else:
+            raise ValueError("Unknown trace format: {}".format(trace_format))
+        
+        if isinstance(output, str):
+            with open(output, "w") as trace_file:
+                trace_file.write(text)
+        else:
+            output.write(text)
+
+def profile_stage(profiler, name):
+    """
+    Time a stage with profiler, or do nothing when profiler is None.
+    """
+    if profiler is None:
+        return contextlib.nullcontext()
     
-    print_country_name("Australia")
-    print_pers_data(au_highest_pers_type, au_highest_pers, au_lowest_pers_type, 
-                    au_lowest_pers)
+    return profiler.stage(name)
+
+def _json_value(value):
+    """
+    Turn a numpy value into a plain Python value for JSON, with NaN as 
+    None.
+    """
+    if isinstance(value, (np.floating, float)):
+        return None if np.isnan(value) else float(value)
+    if isinstance(value, np.integer):
+        return int(value)
+    if isinstance(value, np.str_):
+        return str(value)
+    
+    return value
+
+def build_report(countries, gni_table, pers_table, stages=STAGES, 
+                 profiler=None, regression_type=REGRESSION_TYPE):
+    """
+    Work out the results of the "gni", "pers" and "regression" stages for 
+    the countries as plain data (no printing), for writing out as JSON, CSV
+    or Parquet.
+
+    Parameters
+    ----------
+    countries : iterable or str
+        Names of the countries, or "all" for every country in GNI_FILE.
+    gni_table : CountryTable
+        The GNI_FILE loaded with load_country_table.
+    pers_table : CountryTable
+        The PERSONALITY_FILE loaded with load_country_table.
+    stages : iterable, optional
+        The stages to run. The default is every stage in STAGES.
+    profiler : StageProfiler, optional
+        Times the stages of run_country_pipeline and the "gni_stats" and 
+        "regression" stages. The default is None, for no profiling.
+    regression_type : str, optional
+        The personality type whose share the "regression" stage regresses 
+        the average GNI per capita on. The default is REGRESSION_TYPE.
+
+    Returns
+    -------
+    country_rows : lst
+        A dictionary for each country with its "Country" and, for the "gni" 
+        stage, every statistic of calc_gni_stats and, for the "pers" stage,
+        its most and least common types from run_country_pipeline.
+    regression : dictionary or None
+        For the "regression" stage, the slope, intercept, R2, correlation, 
+        p-value and number of countries of the regression of the share of 
+        regression_type against the average GNI per capita.
+        
+    Raises
+    ------
+    KeyError
+        If a country is in neither file or regression_type is not a 
+        personality type.
+    """
+    result_table = run_country_pipeline(countries, gni_table, pers_table, 
+                                        profiler)
+    names = [row["Country"] for row in result_table]
+    country_rows = [{"Country": name} for name in names]
+    
+    if "gni" in stages:
+        with profile_stage(profiler, "gni_stats"):
+            gni_rows, found = select_countries(
+                gni_table, names, 
+                alias_keys=normalize_aliases(COUNTRY_ALIASES))
+            gni_stats = calc_gni_stats(gni_rows)
+        for i, row in enumerate(country_rows):
+            for key, values in gni_stats.items():
+                if key != "Country":
+                    row[key] = _json_value(values[i]) if found[i] else None
+    
+    if "pers" in stages:
+        pers_keys = ["Most_Common_Type", "Most_Common_Pct", 
+                     "Least_Common_Type", "Least_Common_Pct"]
+        for row, result in zip(country_rows, result_table):
+            row.update((key, result[key]) for key in pers_keys)
+    
+    regression = None
+    if "regression" in stages:
+        with profile_stage(profiler, "regression"):
+            type_shares = select_type_shares(pers_table, names, 
+                                             regression_type)
+            average_gni = [np.nan if row["Average_GNI"] is None 
+                           else row["Average_GNI"] for row in result_table]
+            # correlate_columns leaves out the countries missing either one
+            fit = correlate_columns(type_shares[:, None], average_gni)
+        regression = {"Feature": regression_type, "Target": "Average_GNI"}
+        for key in ["Slope", "Intercept", "R2", "Pearson_R", "Pearson_P"]:
+            regression[key] = _json_value(fit[key][0])
+        regression["N"] = fit["N"]
+        
+    return country_rows, regression
+
+def write_report(country_rows, regression, output_format, output=None):
+    """
+    Write the results of build_report as JSON, CSV or Parquet.
     
-    print_country_name("United States")
-    print_pers_data(us_highest_pers_type, us_highest_pers, us_lowest_pers_type, 
-                    us_lowest_pers)
+    JSON holds both results in one object. CSV and Parquet hold the 
+    country_rows; the regression goes into a second file next to output 
+    with "_regression" added to its name, so CSV and Parquet need an output 
+    file to write a regression.
 
-    print_country_name("New Zealand")
-    print_pers_data(nz_highest_pers_type, nz_highest_pers, nz_lowest_pers_type, 
-                    nz_lowest_pers)
+    Parameters
+    ----------
+    country_rows : lst
+        The country_rows from build_report.
+    regression : dictionary or None
+        The regression from build_report.
+    output_format : str
+        "json", "csv" or "parquet".
+    output : str, optional
+        The file to write. The default is the standard output, which 
+        Parquet cannot use.
 
-    print_country_name("United Kingdom")
-    print_pers_data(uk_highest_pers_type, uk_highest_pers, uk_lowest_pers_type, 
-                    uk_lowest_pers)
+    Returns
+    -------
+    None.
     
-    print_country_name("Sweden")
-    print_pers_data(se_highest_pers_type, se_highest_pers, se_lowest_pers_type, 
-                    se_lowest_pers)
+    Raises
+    ------
+    ValueError
+        If Parquet, or CSV with a regression, is asked for without an 
+        output file.
+    ImportError
+        If Parquet is asked for and pyarrow is not installed.
+    """
+    if output_format == "json":
+        report = {"countries": country_rows}
+        if regression is not None:
+            report["regression"] = regression
+        if output is None:
+            json.dump(report, sys.stdout, indent=2)
+            sys.stdout.write("\n")
+        else:
+            with open(output, "w") as json_file:
+                json.dump(report, json_file, indent=2)
+        return
+    
+    if output is None and output_format == "parquet":
+        raise ValueError("Parquet output needs an output file")
+    
+    tables = [(output, country_rows)]
+    if regression is not None:
+        # A second table on the standard output could not be read as CSV
+        if output is None:
+            raise ValueError("The regression needs an output file with "
+                             "--format {}".format(output_format))
+        root, ext = os.path.splitext(output)
+        tables.append((root + "_regression" + ext, [regression]))
+    
+    if output_format == "parquet":
+        import pyarrow
+        import pyarrow.parquet
+        
+        for path, rows in tables:
+            pyarrow.parquet.write_table(pyarrow.Table.from_pylist(rows), path)
+        return
+    
+    for path, rows in tables:
+        csv_file = sys.stdout if path is None else open(path, "w", 
+                                                        newline="")
+        try:
+            writer = csv.DictWriter(csv_file, fieldnames=list(rows[0]) 
+                                    if rows else ["Country"])
+            writer.writeheader()
+            writer.writerows(rows)
+        finally:
+            if path is not None:
+                csv_file.close()
+
+def parse_args(argv=None):
+    """
+    Read the command-line arguments of the script.
+
+    Parameters
+    ----------
+    argv : lst, optional
+        The arguments. The default is sys.argv[1:].
+
+    Returns
+    -------
+    args : argparse.Namespace
+        The arguments, with args.countries set to a lst of countries or 
+        "all" and args.stages set to a lst of stages.
+    """
+    parser = argparse.ArgumentParser(
+        description="Compare the GNI per capita and the most and least "
+                    "common MBTI personality types of countries.")
+    
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--countries", nargs="+", metavar="COUNTRY", 
+                           help="the countries to analyse (default: the "
+                                "top 10 countries)")
+    selection.add_argument("--group", choices=sorted(COUNTRY_GROUPS), 
+                           help="a named group of countries")
+    selection.add_argument("--all", action="store_true", 
+                           help="every country in the GNI file")
+    
+    parser.add_argument("--stages", 
+                        help="comma-separated stages to run out of {} "
+                             "(default: all of them that the output "
+                             "format can write)".format(", ".join(STAGES)))
+    parser.add_argument("--format", dest="output_format", default="text", 
+                        choices=["text", "json", "csv", "parquet"], 
+                        help="the output format (default: text)")
+    parser.add_argument("--output", "-o", 
+                        help="the file to write JSON, CSV or Parquet to "
+                             "(default: standard output)")
+    parser.add_argument("--report-dir", 
+                        help="write the graphs into this directory instead "
+                             "of showing them")
+    parser.add_argument("--chart-format", default="png", 
+                        choices=["png", "svg"], 
+                        help="the image format of the graphs (default: png)")
+    parser.add_argument("--regression-type", default=REGRESSION_TYPE, 
+                        help="the personality type whose share the "
+                             "regression stage uses (default: {})"
+                             .format(REGRESSION_TYPE))
+    parser.add_argument("--profile", metavar="TRACE_FILE", 
+                        help="write the wall time, CPU time and peak memory "
+                             "of every stage to this file")
+    parser.add_argument("--profile-format", default="jsonl", 
+                        choices=["jsonl", "chrome"], 
+                        help="the format of the --profile file: JSON lines "
+                             "or a Chrome trace (default: jsonl)")
+    
+    args = parser.parse_args(argv)
+    
+    # Check the stages
+    stages_given = args.stages is not None
+    args.stages = [stage.strip() 
+                   for stage in (args.stages or ",".join(STAGES)).split(",")
+                   if stage.strip()]
+    unknown = [stage for stage in args.stages if stage not in STAGES]
+    if unknown:
+        parser.error("unknown stages: {}".format(", ".join(unknown)))
+    
+    # Pick the countries
+    if args.all:
+        args.countries = "all"
+    elif args.group:
+        args.countries = COUNTRY_GROUPS[args.group]
+    elif not args.countries:
+        args.countries = TOP_COUNTRIES
+    
+    if args.output_format != "text":
+        # The charts are only drawn into --report-dir with these formats
+        if "charts" in args.stages and args.report_dir is None:
+            if stages_given:
+                parser.error("--report-dir is needed to draw the charts "
+                             "with --format {}".format(args.output_format))
+            args.stages.remove("charts")
+        if args.output_format == "parquet":
+            if args.output is None:
+                parser.error("--output is needed with --format parquet")
+            if importlib.util.find_spec("pyarrow") is None:
+                parser.error("--format parquet needs pyarrow, install it "
+                             "with: pip install pyarrow")
+        
+        # CSV on the standard output holds only the country table
+        if (args.output_format == "csv" and args.output is None 
+                and "regression" in args.stages):
+            if stages_given:
+                parser.error("--output is needed for the regression stage "
+                             "with --format csv")
+            args.stages.remove("regression")
+    
+    return args
+
+def run_cli(argv=None):
+    """
+    Run the script from the command line: pick the countries and stages, 
+    then either print the text of main() or write the results as JSON, CSV 
+    or Parquet (drawing the graphs into --report-dir if asked to).
+
+    Parameters
+    ----------
+    argv : lst, optional
+        The arguments. The default is sys.argv[1:].
+
+    Returns
+    -------
+    exit_code : int
+        0 on success, 1 if a country is not in either file.
+    """
+    args = parse_args(argv)
+    profiler = StageProfiler() if args.profile else None
+    
+    try:
+        return _run_cli_stages(args, profiler)
+    except KeyError as error:
+        print("error: {}".format(error.args[0]), file=sys.stderr)
+        return 1
+    finally:
+        if profiler is not None:
+            profiler.close()
+            profiler.write(args.profile, args.profile_format)
+
+def _run_cli_stages(args, profiler):
+    """
+    Run the stages picked on the command line for run_cli.
+    """
+    if args.output_format == "text":
+        main(args.countries, args.report_dir, args.chart_format, args.stages, 
+             profiler, args.regression_type)
+        return 0
+    
+    with profile_stage(profiler, "read"):
+        gni_table = load_country_table_cached(os.path.join(DATA_DIR, 
+                                                           GNI_FILE))
+        pers_table = load_country_table_cached(os.path.join(
+            DATA_DIR, PERSONALITY_FILE))
+    country_rows, regression = build_report(args.countries, gni_table, 
+                                            pers_table, args.stages, profiler,
+                                            args.regression_type)
+    
+    with profile_stage(profiler, "write"):
+        write_report(country_rows, regression, args.output_format, 
+                     args.output)
+    
+    if "charts" in args.stages:
+        with profile_stage(profiler, "plot"):
+            names = [row["Country"] for row in country_rows]
+            gni_rows, found = select_countries(
+                gni_table, names, 
+                alias_keys=normalize_aliases(COUNTRY_ALIASES))
+            average_gni = calc_gni_stats(gni_rows)["Average_GNI"]
+            has_gni = found & ~np.isnan(average_gni)
+            render_gni_chart(gni_rows.countries[has_gni].tolist(), 
+                             average_gni[has_gni].tolist(), args.report_dir, 
+                             args.chart_format)
+            render_pers_charts(names, pers_table, args.report_dir, 
+                               args.chart_format)
+    
+    return 0
+
+def main(countries=TOP_COUNTRIES, report_dir=None, fmt="png", stages=STAGES, 
+         profiler=None, regression_type=REGRESSION_TYPE):
+    """
+    Print the average GNI per capita and the most and least common 
+    personality types for each of the countries, then graph them and draw 
+    the regression of the share of regression_type (by default INFP-T, the 
+    most common type in every one of TOP_COUNTRIES) against the average GNI 
+    per capita. 
+    
+    By default these are the top 10 countries in the world according to the 
+    US news (TOP_COUNTRIES); pass any lst of countries, or "all", instead.
+    
+    In report mode (when report_dir is given) nothing is shown on the 
+    screen: matplotlib uses the non-GUI Agg backend and every graph is 
+    written into report_dir in the fmt format ("png" or "svg") under the 
+    name from chart_filename.
+    
+    Only the stages in stages (see STAGES) are run. Without "charts" and 
+    "regression" only text is printed and matplotlib and sklearn are never 
+    imported.
+    
+    Pass a StageProfiler as profiler to time the stages of the run: "read", 
+    "extract", "gni_average", "pers_extremes", "print", "plot" and 
+    "regression".
+    """
+    charts = "charts" in stages
     
-    print_country_name("Netherlands")
-    print_pers_data(nl_highest_pers_type, nl_highest_pers, nl_lowest_pers_type, 
-                    nl_lowest_pers) 
+    # Never open a window in report mode
+    if report_dir is not None and charts:
+        import matplotlib
+        matplotlib.use("Agg")
     
+    # Read in the file of the GNI per capita of each country from 
+    # years 1990-2018 and the file of the distribution of each personality 
+    # type in each country.
+    with profile_stage(profiler, "read"):
+        gni_table = load_country_table_cached(os.path.join(DATA_DIR, 
+                                                           GNI_FILE))
+        pers_table = load_country_table_cached(os.path.join(
+            DATA_DIR, PERSONALITY_FILE))
+    
+    # Find the average GNI per capita and the most and least common 
+    # personality types for every country in one pass.
+    result_table = run_country_pipeline(countries, gni_table, pers_table, 
+                                        profiler)
+    countries_lst = [row["Country"] for row in result_table]
+    
+    # The share of the type of the regression in each country, looked up 
+    # before anything is printed so an unknown type fails straight away
+    if "regression" in stages:
+        type_shares = select_type_shares(pers_table, countries_lst, 
+                                         regression_type)
+    
+    gni_rows = [row for row in result_table if row["Average_GNI"] is not None]
+    
+    with profile_stage(profiler, "print"):
+        if "gni" in stages and gni_rows:
+            # Print the avergae GNI per capita for each country
+            print("Here are the average GNI per capita for each country...")
+            print("------------------------")
+            for row in gni_rows:
+                print_gni_data(row["Country"], round(row["Average_GNI"], 2))
+        
+            # Compare the values in the result_table to find the value of 
+            # the highest avg GNI per capita and its corresponding country 
+            # and find the value of the lowest avg GNI per capita and its 
+            # corresponding country. 
+            top_avg_gni, top_country, lowest_avg_gni, low_country = (
+                compare_gni_value(gni_rows))
+        
+            print("\nThese are the highest and lowest GNI per capita...")
+            print("------------------------")
+            print("The highest average GNI per capita is ${} from {}."
+                  .format(round(top_avg_gni, 2), top_country))
+            print("The lowest average GNI per capita is ${} from {}."
+                  .format(round(lowest_avg_gni, 2), low_country))
+    
+        if "pers" in stages:
+            # Print personality data for each country
+            print("\nHere are the personality data for each country...")
+            print("------------------------") 
+            for row in result_table:
+                if row["Most_Common_Type"] is not None:
+                    print_country_name(row["Country"])
+                    print_pers_data(row["Most_Common_Type"], 
+                                    row["Most_Common_Pct"], 
+                                    row["Least_Common_Type"], 
+                                    row["Least_Common_Pct"])
     
     """ 
     Since we have the same personality types of each of the country as the 
@@ -896,39 +3756,43 @@ def main():
     is a correlation between the percentage of hat personaluity type and the 
     gross national income per capita for each country.
     """
-    
-    # Combine the most common personalities % of the 10 countries into a list
-    top_pers_lst = combine_into_lst(ca_highest_pers, jp_highest_pers, 
-                                             ge_highest_pers, sw_highest_pers, 
-                                             au_highest_pers, us_highest_pers, 
-                                             nz_highest_pers, uk_highest_pers,
-                                             se_highest_pers, nl_highest_pers)  
-    
-    # Convert the top_pers_lst into a nested list
-    nested_top_pers_lst = combine_into_nested_lst(top_pers_lst)
-
-    # Combine all of the top 10 country personality % in a list of list 
-    total_pers_lst = combine_into_lst(ca_pers_lst, jp_pers_lst, 
-                                              ge_pers_lst, sw_pers_lst,
-                                              au_pers_lst, us_pers_lst,
-                                              nz_pers_lst, uk_pers_lst, 
-                                              se_pers_lst, nl_pers_lst)
      
-    # Create a bar graph for the avergae GNI per capita for each country
-    graph_bar_gni_data(countries_lst, lst_of_avg_gni)
-    
-    # Loop through 10 times for each country
-    # Assign each country's personality %'s into a variable for plotting
-    # Create a variable for the list of country names for graph titles
-    for i in range(len(countries_lst)):
-        personality_percentages = total_pers_lst[i]
-        country = countries_lst[i]
-    
-        # Create bar graphs for the % of each personality in each country
-        graph_bar_graph_pers(country, pers_header, personality_percentages) 
-    
-    # Draw a linear regression of the curve 
-    graph_regression(nested_top_pers_lst, lst_of_avg_gni)
+    if charts:
+        with profile_stage(profiler, "plot"):
+            # Create a bar graph for the avergae GNI per capita for each 
+            # country
+            graph_bar_gni_data([row["Country"] for row in gni_rows], 
+                               [row["Average_GNI"] for row in gni_rows], 
+                               report_dir, fmt)
+        
+            # Create bar graphs for the % of each personality in each 
+            # country, rendering them in parallel in report mode
+            if report_dir is not None:
+                render_pers_charts(countries_lst, pers_table, report_dir, fmt)
+            else:
+                pers_header = ["Country"] + list(pers_table.columns)
+                pers_rows, pers_found = select_countries(
+                    pers_table, countries_lst, 
+                    alias_keys=normalize_aliases(COUNTRY_ALIASES))
+                for i, country in enumerate(countries_lst):
+                    if pers_found[i]:
+                        graph_bar_graph_pers(country, pers_header, 
+                                             list(pers_rows.values[i]))
+    
+    # Draw a linear regression of the curve for the countries that have 
+    # both a GNI per capita and a share of the type
+    if "regression" in stages:
+        both_rows = [(row["Average_GNI"], float(share)) 
+                     for row, share in zip(result_table, type_shares) 
+                     if row["Average_GNI"] is not None 
+                     and not np.isnan(share)]
+        if len(both_rows) > 1:
+            with profile_stage(profiler, "regression"):
+                # Convert the percentages of the type into a nested list
+                graph_regression(
+                    combine_into_nested_lst([row[1] for row in both_rows]), 
+                    [row[0] for row in both_rows], report_dir, fmt, 
+                    plot=charts, pers_type=regression_type)
     
     """
     Our team used for-loop iteration by value, matplotlib, csv library, 
@@ -976,4 +3840,5 @@ def main():
     understand human nature in numbers and personality data. 
     """
     
-main()
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(run_cli())
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup-time benchmark for DS2001_final_project.py.
+
+Times a fresh interpreter that imports the module and prints the text-only
+report (main with only the "gni" and "pers" stages), and checks that none of
+the plotting or modelling libraries were imported on the way. Exits with
+status 1 when a heavy library is imported or the median time is over
+--max-ms (500 ms by default), so it can guard against a top-level import
+creeping back in.
+
+Usage: python bench_startup.py [--runs 10] [--max-ms 500]
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# The libraries that a text-only run must not import
+HEAVY_MODULES = ["matplotlib", "scipy", "sklearn"]
+
+"""
+The code run in each fresh interpreter. It prints the names of the heavy
+libraries that ended up imported on its last line.
+"""
+TEXT_ONLY_RUN = """
+import contextlib, io, sys
+import DS2001_final_project
+with contextlib.redirect_stdout(io.StringIO()):
+    DS2001_final_project.main(stages=("gni", "pers"))
+print(",".join(name for name in {heavy!r} if name in sys.modules))
+""".format(heavy=HEAVY_MODULES)
+
+def time_text_only_run():
+    """
+    Run the text-only report once in a fresh interpreter.
+
+    Returns
+    -------
+    elapsed_ms : float
+        The wall time of the run in milliseconds, including the start of the
+        interpreter.
+    loaded : lst
+        The heavy libraries that were imported.
+    """
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, "-c", TEXT_ONLY_RUN],
+                               cwd=PROJECT_DIR, capture_output=True,
+                               text=True, check=True)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+
+    last_line = completed.stdout.strip().splitlines()[-1:] or [""]
+    loaded = [name for name in last_line[0].split(",") if name]
+
+    return elapsed_ms, loaded
+
+def main():
+    """
+    Time the text-only report and print the results.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--runs", type=int, default=10,
+                        help="number of timed runs (default: 10)")
+    parser.add_argument("--max-ms", type=float, default=500,
+                        help="fail if the median run takes longer, 0 to "
+                             "not check the time (default: 500)")
+    args = parser.parse_args()
+
+    # The first run writes the binary cache, so it is not timed
+    time_text_only_run()
+
+    timings = []
+    loaded = set()
+    for _ in range(args.runs):
+        elapsed_ms, run_loaded = time_text_only_run()
+        timings.append(elapsed_ms)
+        loaded.update(run_loaded)
+
+    median_ms = statistics.median(timings)
+    print("text-only run: median {:.1f} ms, min {:.1f} ms over {} runs"
+          .format(median_ms, min(timings), args.runs))
+
+    failed = False
+    if loaded:
+        print("FAIL: imported {}".format(", ".join(sorted(loaded))))
+        failed = True
+    if args.max_ms > 0 and median_ms > args.max_ms:
+        print("FAIL: median is over {:.1f} ms".format(args.max_ms))
+        failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
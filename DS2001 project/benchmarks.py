@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite for the stages of DS2001_final_project.py.
+
+Times loading, country lookup, GNI averaging, finding the most and least
+common personality types and drawing the charts. Each stage is timed in its
+original row-by-row form and in its batched form, against the bundled files
+and against synthetic files (from make_synthetic_data.py) with 10x, 100x and
+1000x the rows. The results are written as JSON so the timings of two
+versions can be compared.
+
+Usage: python benchmarks.py [--scales 1 10 100 1000] [--repeat 3]
+                            [--output benchmark_results.json] [--skip-charts]
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import numpy as np
+
+import DS2001_final_project as project
+import make_synthetic_data
+
+# The number of countries that are looked up, averaged and ranked one at a
+# time by the row-by-row functions, so their cost per country can be compared
+# at every scale without timing hundreds of thousands of calls
+SAMPLE_COUNTRIES = 50
+
+# The number of countries in the bundled files, which the scales multiply
+BUNDLED_GNI_ROWS = 208
+BUNDLED_PERS_ROWS = 158
+
+def time_call(function, repeat=3):
+    """
+    Time a function, keeping the best of repeat runs.
+
+    Parameters
+    ----------
+    function : callable
+        The function to time. It is called without arguments.
+    repeat : int, optional
+        The number of runs. The default is 3.
+
+    Returns
+    -------
+    seconds : float
+        The wall time of the fastest run.
+    """
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+
+    return min(timings)
+
+def write_scaled_files(scale, directory):
+    """
+    Write a synthetic GNI file and personality file with scale times the
+    rows of the bundled files, using make_synthetic_data.
+
+    Parameters
+    ----------
+    scale : int
+        The multiplier of the number of rows.
+    directory : str
+        The directory to write the files into.
+
+    Returns
+    -------
+    gni_file : str
+        The path of the GNI file.
+    pers_file : str
+        The path of the personality file.
+    """
+    gni_file = os.path.join(directory, "x{}_{}".format(scale,
+                                                        project.GNI_FILE))
+    pers_file = os.path.join(directory, "x{}_{}".format(
+        scale, project.PERSONALITY_FILE))
+
+    make_synthetic_data.write_gni_file(gni_file, scale * BUNDLED_GNI_ROWS)
+    make_synthetic_data.write_pers_file(pers_file,
+                                        scale * BUNDLED_PERS_ROWS)
+
+    return gni_file, pers_file
+
+def benchmark_scale(gni_file, pers_file, scale, repeat, charts, cache_dir):
+    """
+    Time every stage against one pair of files.
+
+    Returns
+    -------
+    results : lst
+        A dictionary for each timing with the keys "stage", "function",
+        "scale", "rows", "items" and "seconds".
+    """
+    results = []
+
+    def record(stage, function_name, rows, items, function):
+        seconds = time_call(function, repeat)
+        results.append({"stage": stage, "function": function_name,
+                        "scale": scale, "rows": rows, "items": items,
+                        "seconds": seconds})
+
+    # Loading
+    gni_nested_lst = project.read_in_file(gni_file)
+    pers_nested_lst = project.read_in_file(pers_file)
+    gni_rows = len(gni_nested_lst) - 1
+    pers_rows = len(pers_nested_lst) - 1
+    record("load", "read_in_file", gni_rows, 1,
+           lambda: project.read_in_file(gni_file))
+    record("load", "load_country_table", gni_rows, 1,
+           lambda: project.load_country_table(gni_file))
+    project.load_country_table_cached(gni_file, cache_dir)
+    record("load", "load_country_table_cached (warm)", gni_rows, 1,
+           lambda: project.load_country_table_cached(gni_file, cache_dir))
+
+    gni_table = project.load_country_table(gni_file)
+    pers_table = project.load_country_table(pers_file)
+
+    # Lookup of a sample of countries spread over the file
+    sample = [row[0] for row in gni_nested_lst[1::max(1, gni_rows
+                                                       // SAMPLE_COUNTRIES)]]
+    sample = sample[:SAMPLE_COUNTRIES]
+    gni_index = project.build_country_index(
+        row[0] for row in gni_nested_lst)
+    record("lookup", "get_specific_country (no index)", gni_rows,
+           len(sample), lambda: [project.get_specific_country(
+               gni_nested_lst, name) for name in sample])
+    record("lookup", "build_country_index", gni_rows, 1,
+           lambda: project.build_country_index(
+               row[0] for row in gni_nested_lst))
+    record("lookup", "get_countries (indexed)", gni_rows, len(sample),
+           lambda: project.get_countries(gni_nested_lst, gni_index, sample))
+
+    # GNI averaging, one country at a time for the sample (only rows with
+    # every year, since calc_average_gni cannot read '..') and for every
+    # country at once
+    full_rows = [project.get_specific_country(gni_nested_lst, name,
+                                              gni_index) for name in sample]
+    full_rows = [row for row in full_rows
+                 if all(cell.strip().isdigit() for cell in row[1:])]
+    record("gni", "make_dctn + calc_average_gni", gni_rows, len(full_rows),
+           lambda: [project.calc_average_gni(project.make_dctn(row))
+                    for row in full_rows])
+    record("gni", "calc_gni_stats", gni_rows, gni_rows,
+           lambda: project.calc_gni_stats(gni_table))
+
+    # Most and least common personality types
+    pers_header = project.get_header_lst(pers_nested_lst)
+    pers_sample = pers_nested_lst[1:SAMPLE_COUNTRIES + 1]
+
+    def rank_one_at_a_time():
+        for row in pers_sample:
+            pers_lst = list(row)
+            highest, lowest = project.compare_pers_value(pers_lst)
+            project.pers_headers(pers_lst, pers_header, highest, lowest)
+
+    record("pers", "compare_pers_value + pers_headers", pers_rows,
+           len(pers_sample), rank_one_at_a_time)
+    record("pers", "rank_pers_types", pers_rows, pers_rows,
+           lambda: project.rank_pers_types(pers_table, k=1))
+
+    # Charts of 10 countries, which cost the same at every scale: the top 10
+    # countries in the bundled files, and the first 10 countries in both
+    # synthetic files (which have none of the top 10)
+    if charts:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+
+        chart_dir = os.path.join(cache_dir, "charts")
+        joined = project.join_country_tables(gni_table, pers_table)
+        chart_countries = list(project.TOP_COUNTRIES)
+        if not all(project.select_countries(joined.gni,
+                                            chart_countries)[1]):
+            chart_countries = joined.countries[:len(chart_countries)].tolist()
+        average_gni = project.calc_gni_stats(project.select_countries(
+            gni_table, chart_countries)[0])["Average_GNI"].tolist()
+        pers_values = project.select_countries(
+            pers_table, chart_countries)[0].values
+        pers_header = ["Country"] + pers_table.columns.tolist()
+
+        type_shares = project.select_type_shares(
+            pers_table, chart_countries, project.REGRESSION_TYPE)
+        x_lst = project.combine_into_nested_lst(type_shares.tolist())
+
+        # Under Agg plt.show() does not draw anything, so save the figure in
+        # its place: then the pyplot graphs are rasterized and written to a
+        # file like the ones of the headless renderers
+        pyplot_dir = os.path.join(cache_dir, "pyplot")
+        os.makedirs(pyplot_dir, exist_ok=True)
+        shown = []
+
+        def show_into_file():
+            shown.append(os.path.join(pyplot_dir,
+                                      "{}.png".format(len(shown))))
+            plt.gcf().savefig(shown[-1], bbox_inches="tight")
+
+        def graph_pyplot(draw):
+            with mock.patch.object(plt, "show", show_into_file):
+                draw()
+            plt.close("all")
+
+        def graph_pers_pyplot():
+            for i, country in enumerate(chart_countries):
+                project.graph_bar_graph_pers(country, pers_header,
+                                             pers_values[i].tolist())
+
+        # graph_bar_gni_data saves 1.png before it shows the graph, so its
+        # show is left to do nothing
+        record("charts", "graph_bar_graph_pers", pers_rows,
+               len(chart_countries),
+               lambda: graph_pyplot(graph_pers_pyplot))
+        record("charts", "render_pers_charts", pers_rows,
+               len(chart_countries),
+               lambda: project.render_pers_charts(
+                   chart_countries, pers_table, chart_dir))
+        record("charts", "graph_bar_gni_data", gni_rows, 1,
+               lambda: (project.graph_bar_gni_data(chart_countries,
+                                                   average_gni),
+                        plt.close("all")))
+        record("charts", "render_gni_chart", gni_rows, 1,
+               lambda: project.render_gni_chart(chart_countries,
+                                                average_gni, chart_dir))
+
+        # graph_regression prints the coefficient on every run
+        with contextlib.redirect_stdout(io.StringIO()):
+            record("charts", "graph_regression", pers_rows, 1,
+                   lambda: graph_pyplot(lambda: project.graph_regression(
+                       x_lst, average_gni)))
+            record("charts", "graph_regression (report mode)", pers_rows,
+                   1, lambda: project.graph_regression(x_lst, average_gni,
+                                                       chart_dir))
+
+    return results
+
+def main():
+    """
+    Run the benchmarks at every scale and write the results as JSON.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--scales", type=int, nargs="+",
+                        default=[1, 10, 100, 1000],
+                        help="row multipliers of the bundled files "
+                             "(default: 1 10 100 1000)")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="runs of each timing, keeping the best "
+                             "(default: 3)")
+    parser.add_argument("--output", default="benchmark_results.json",
+                        help="the JSON file to write "
+                             "(default: benchmark_results.json)")
+    parser.add_argument("--skip-charts", action="store_true",
+                        help="do not time the charts")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The charts are left in the working directory by graph_bar_gni_data
+        # (as 1.png), so run everything from the temporary directory
+        start_dir = os.getcwd()
+        os.chdir(work_dir)
+        try:
+            for scale in args.scales:
+                if scale == 1:
+                    gni_file = os.path.join(project.DATA_DIR,
+                                            project.GNI_FILE)
+                    pers_file = os.path.join(project.DATA_DIR,
+                                             project.PERSONALITY_FILE)
+                else:
+                    gni_file, pers_file = write_scaled_files(scale,
+                                                             work_dir)
+                scale_results = benchmark_scale(
+                    gni_file, pers_file, scale, args.repeat,
+                    not args.skip_charts, work_dir)
+                for result in scale_results:
+                    print("x{:<5} {:<8} {:<45} {:>10.4f} s".format(
+                        scale, result["stage"], result["function"],
+                        result["seconds"]))
+                results.extend(scale_results)
+        finally:
+            os.chdir(start_dir)
+
+    report = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "repeat": args.repeat,
+        "results": results,
+        }
+    with open(args.output, "w") as json_file:
+        json.dump(report, json_file, indent=2)
+    print("wrote {}".format(args.output))
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
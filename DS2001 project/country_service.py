@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Local HTTP query service over the GNI per capita and personality data.
+
+Both files are loaded once into a CountryDataset when the service starts,
+and every request is answered from it as JSON:
+    GET /country/{name}/gni - the GNI per capita statistics of a country
+    GET /country/{name}/types?top=3 - its most and least common types
+    GET /country/{name}/similar?k=5&metric=cosine - the countries with the
+        closest personality profiles
+    GET /correlate?type=INFP-T - the correlation of a type with the average
+        GNI per capita (every type without ?type=)
+Responses are kept in an LRU cache, so a repeated query is answered without
+touching the dataset. The service only uses asyncio from the standard
+library and keeps connections open between requests (HTTP/1.1 keep-alive).
+
+Usage: python country_service.py [--host 127.0.0.1] [--port 8000]
+                                 [--cache-size 1024]
+"""
+
+import argparse
+import asyncio
+from collections import OrderedDict
+from http import HTTPStatus
+import json
+import sys
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import numpy as np
+
+import DS2001_final_project as project
+
+def to_json(value):
+    """
+    Turn a result of CountryDataset (with numpy arrays and values, and NaN
+    for missing values) into plain Python values for JSON.
+    """
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [to_json(item) for item in value]
+
+    return project._json_value(value)
+
+class CountryService:
+    """
+    Answers the queries of the service from a CountryDataset, keeping the
+    encoded responses in an LRU cache.
+
+    Parameters
+    ----------
+    dataset : CountryDataset
+        The loaded data.
+    cache_size : int, optional
+        The number of responses to keep. The default is 1024 and 0 turns
+        the cache off.
+    """
+
+    def __init__(self, dataset, cache_size=1024):
+        self.dataset = dataset
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+
+    def route(self, path, query):
+        """
+        Answer one query.
+
+        Parameters
+        ----------
+        path : str
+            The path of the request, like "/country/Canada/gni".
+        query : dictionary
+            The query string parsed with parse_qs.
+
+        Returns
+        -------
+        result : dictionary or lst
+            The answer, ready for to_json.
+
+        Raises
+        ------
+        LookupError
+            If nothing is at the path or the country or type is not in the
+            data (404).
+        ValueError
+            If a query parameter is not valid (400).
+        """
+        parts = [unquote(part) for part in path.strip("/").split("/")]
+
+        def param(name, default=None):
+            return query[name][-1] if name in query else default
+
+        if len(parts) == 3 and parts[0] == "country":
+            name, resource = parts[1], parts[2]
+            if resource == "gni":
+                return self.dataset.gni_stats(name)
+            if resource == "types":
+                return self.dataset.top_types(name, int(param("top", 1)))
+            if resource == "similar":
+                similar = self.dataset.similar_countries(
+                    name, int(param("k", 5)), param("metric", "cosine"))
+                return {"Country": name, "Similar": similar}
+        elif parts == ["correlate"]:
+            return self.dataset.correlate(param("type"))
+
+        raise LookupError("No such resource: {}".format(path))
+
+    def respond(self, target):
+        """
+        Get the status and JSON body of the response to a request target,
+        from the cache when the same target was asked for before.
+
+        Parameters
+        ----------
+        target : str
+            The path and query string of the request.
+
+        Returns
+        -------
+        status : HTTPStatus
+            The status of the response.
+        body : bytes
+            The JSON of the response.
+        """
+        cached = self._cache.get(target)
+        if cached is not None:
+            self._cache.move_to_end(target)
+            return cached
+
+        url = urlsplit(target)
+        try:
+            result = (HTTPStatus.OK, to_json(self.route(url.path,
+                                                        parse_qs(url.query))))
+        except LookupError as error:
+            result = (HTTPStatus.NOT_FOUND, {"error": str(error.args[0])})
+        except ValueError as error:
+            result = (HTTPStatus.BAD_REQUEST, {"error": str(error)})
+        response = (result[0], json.dumps(result[1]).encode("utf-8"))
+
+        # Only keep answers that do not depend on a mistyped request
+        if self.cache_size > 0 and response[0] != HTTPStatus.BAD_REQUEST:
+            self._cache[target] = response
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return response
+
+    async def handle_connection(self, reader, writer):
+        """
+        Answer the requests of one connection until the client closes it or
+        asks to. A request that cannot be read or is not a GET is answered
+        and then the connection is closed, since the rest of it (like the
+        body of a POST) cannot be told apart from the next request.
+        """
+        try:
+            while True:
+                # readline raises ValueError for a line over the limit of
+                # the reader
+                try:
+                    request_line = await reader.readline()
+                    if not request_line.strip():
+                        break
+                    method, target, version = (request_line.decode("latin-1")
+                                               .split())
+
+                    # Read the headers, keeping only the Connection header
+                    connection = ""
+                    while True:
+                        line = await reader.readline()
+                        if not line.strip():
+                            break
+                        name, _, value = (line.decode("latin-1")
+                                          .partition(":"))
+                        if name.strip().lower() == "connection":
+                            connection = value.strip().lower()
+                except (ValueError, asyncio.LimitOverrunError):
+                    await self._write(writer, HTTPStatus.BAD_REQUEST,
+                                      b'{"error": "bad request"}', False)
+                    break
+
+                if method != "GET":
+                    await self._write(writer, HTTPStatus.METHOD_NOT_ALLOWED,
+                                      b'{"error": "only GET is supported"}',
+                                      False)
+                    break
+
+                keep_alive = (connection != "close" if version == "HTTP/1.1"
+                              else connection == "keep-alive")
+                status, body = self.respond(target)
+                await self._write(writer, status, body, keep_alive)
+
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except ConnectionError:
+                pass
+
+    async def _write(self, writer, status, body, keep_alive):
+        """
+        Write one response.
+        """
+        head = ("HTTP/1.1 {} {}\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: {}\r\n\r\n"
+                .format(status.value, status.phrase, len(body),
+                        "keep-alive" if keep_alive else "close"))
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()
+
+async def serve(host="127.0.0.1", port=8000, cache_size=1024, dataset=None):
+    """
+    Load the data and answer requests until the service is stopped.
+
+    Parameters
+    ----------
+    host : str, optional
+        The address to listen on. The default is 127.0.0.1.
+    port : int, optional
+        The port to listen on. The default is 8000.
+    cache_size : int, optional
+        The number of responses to keep in the cache. The default is 1024.
+    dataset : CountryDataset, optional
+        The data to answer from. The default loads the bundled files.
+
+    Returns
+    -------
+    None.
+    """
+    if dataset is None:
+        dataset = project.CountryDataset()
+    # Work out the correlations before the first request asks for them
+    dataset.correlate()
+
+    service = CountryService(dataset, cache_size)
+    server = await asyncio.start_server(service.handle_connection, host,
+                                        port)
+    print("serving on http://{}:{}".format(host, port), flush=True)
+
+    async with server:
+        await server.serve_forever()
+
+def main():
+    """
+    Run the service from the command line.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="the address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000,
+                        help="the port to listen on (default: 8000)")
+    parser.add_argument("--cache-size", type=int, default=1024,
+                        help="responses kept in the LRU cache, 0 for none "
+                             "(default: 1024)")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.cache_size))
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic dataset generator for scaling tests of DS2001_final_project.py.
+
+Writes CSV files in exactly the layouts of the bundled files:
+    GNI_per_capita.csv - Country, 1990..2018, Info (with the byte order mark
+        and '..' for missing years)
+    country_personality_types.csv - Country and the 32 MBTI types, whose
+        shares add up to 1 in every row
+with any number of rows, a rate of missing values and a rate of country
+names that contain each other, like "Niger"/"Nigeria" and
+"Sudan"/"South Sudan". Rows are made and written a batch at a time, so
+memory stays flat however large the files are.
+
+Usage: python make_synthetic_data.py OUTPUT_DIR [--gni-rows 208]
+           [--pers-rows 158] [--missing-rate 0.02] [--collision-rate 0.05]
+           [--seed 0] [--batch-size 10000]
+"""
+
+import argparse
+import csv
+import itertools
+import os
+import sys
+
+import numpy as np
+
+import DS2001_final_project as project
+
+# Country names are made of these syllables. Every one is a consonant and a
+# vowel, so adding "ia" to a name can never give another generated name.
+SYLLABLES = ["ba", "da", "fe", "ga", "ho", "ka", "la", "mo", "na", "pe",
+             "ri", "sa", "to", "ve", "wu", "zi", "bo", "ne", "ru", "te"]
+
+# The years of GNI_FILE
+YEARS = list(range(1990, 2019))
+
+def read_pers_types():
+    """
+    Get the 32 personality types in the order of the columns of the bundled
+    PERSONALITY_FILE.
+
+    Returns
+    -------
+    pers_types : lst
+        The personality types, like "ESTJ-A".
+    """
+    with open(os.path.join(project.DATA_DIR, project.PERSONALITY_FILE), "r",
+              newline="") as csv_file:
+        header = next(csv.reader(csv_file))
+
+    return header[1:]
+
+def make_name(number):
+    """
+    Make the unique name of country number out of SYLLABLES, like "Kalamo".
+    """
+    syllables = []
+    number += len(SYLLABLES)
+    while number:
+        number, digit = divmod(number, len(SYLLABLES))
+        syllables.append(SYLLABLES[digit])
+
+    return "".join(reversed(syllables)).capitalize()
+
+def iter_country_names(num_rows, collision_rate, seed):
+    """
+    Yield num_rows unique country names. With probability collision_rate a
+    name is followed by a name that contains it: either the name with "ia"
+    added (like "Niger" and "Nigeria") or "South" in front of it (like
+    "Sudan" and "South Sudan").
+
+    Parameters
+    ----------
+    num_rows : int
+        The number of names.
+    collision_rate : float
+        The probability that a name is followed by a name containing it.
+    seed : int
+        The seed of the random number generator. The same seed always gives
+        the same names, so files made with it share their countries.
+
+    Yields
+    ------
+    name : str
+        The next country name.
+    """
+    rng = np.random.default_rng([seed, 0])
+    number = 0
+    made = 0
+    while made < num_rows:
+        name = make_name(number)
+        number += 1
+        yield name
+        made += 1
+
+        if made < num_rows and rng.random() < collision_rate:
+            yield (name + "ia" if rng.random() < 0.5
+                   else "South " + name)
+            made += 1
+
+def iter_batches(num_rows, batch_size):
+    """
+    Yield the size of each batch of rows.
+    """
+    for start in range(0, num_rows, batch_size):
+        yield min(batch_size, num_rows - start)
+
+def write_gni_file(path, num_rows, missing_rate=0.02, collision_rate=0.05,
+                   seed=0, batch_size=10000):
+    """
+    Write a synthetic GNI per capita file in the layout of GNI_FILE. Each
+    country gets a starting GNI per capita and grows by a random rate every
+    year.
+
+    Parameters
+    ----------
+    path : str
+        The file to write.
+    num_rows : int
+        The number of countries.
+    missing_rate : float, optional
+        The probability that a year is missing ('..'). The default is 0.02.
+    collision_rate : float, optional
+        The rate of names that contain the name before them, see
+        iter_country_names. The default is 0.05.
+    seed : int, optional
+        The seed of the random number generator. The default is 0.
+    batch_size : int, optional
+        The number of rows made and written at once. The default is 10000.
+
+    Returns
+    -------
+    None.
+    """
+    rng = np.random.default_rng([seed, 1])
+    names = iter_country_names(num_rows, collision_rate, seed)
+
+    with open(path, "w", encoding="utf-8-sig", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Country"] + [str(year) for year in YEARS]
+                        + ["Info"])
+
+        for size in iter_batches(num_rows, batch_size):
+            start = rng.lognormal(mean=8.5, sigma=1.1, size=(size, 1))
+            growth = rng.normal(0.015, 0.04, size=(size, len(YEARS) - 1))
+            gni = start * np.cumprod(
+                np.concatenate([np.ones((size, 1)), 1 + growth], axis=1),
+                axis=1)
+            cells = np.maximum(gni, 100).round().astype(np.int64).astype(str)
+            cells[rng.random(cells.shape) < missing_rate] = ".."
+
+            writer.writerows([name] + row + [""] for name, row
+                             in zip(itertools.islice(names, size),
+                                    cells.tolist()))
+
+def write_pers_file(path, num_rows, missing_rate=0.0, collision_rate=0.05,
+                    seed=0, batch_size=10000):
+    """
+    Write a synthetic personality file in the layout of PERSONALITY_FILE.
+    The shares of each country are drawn from a Dirichlet distribution, so
+    they add up to 1.
+
+    Parameters
+    ----------
+    path : str
+        The file to write.
+    num_rows : int
+        The number of countries.
+    missing_rate : float, optional
+        The probability that a share is missing (a blank cell). The default
+        is 0, like the bundled file.
+    collision_rate : float, optional
+        The rate of names that contain the name before them, see
+        iter_country_names. The default is 0.05.
+    seed : int, optional
+        The seed of the random number generator. The default is 0.
+    batch_size : int, optional
+        The number of rows made and written at once. The default is 10000.
+
+    Returns
+    -------
+    None.
+    """
+    rng = np.random.default_rng([seed, 2])
+    names = iter_country_names(num_rows, collision_rate, seed)
+    pers_types = read_pers_types()
+
+    # Some types are much more common than others, like in the bundled file
+    concentration = rng.gamma(2.0, 2.0, size=len(pers_types))
+
+    with open(path, "w", encoding="utf-8", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["Country"] + pers_types)
+
+        for size in iter_batches(num_rows, batch_size):
+            shares = rng.dirichlet(concentration, size=size)
+            cells = [[repr(share) for share in row]
+                     for row in shares.tolist()]
+            if missing_rate:
+                missing = rng.random(shares.shape) < missing_rate
+                for row_cells, row_missing in zip(cells, missing.tolist()):
+                    for indx, is_missing in enumerate(row_missing):
+                        if is_missing:
+                            row_cells[indx] = ""
+
+            writer.writerows([name] + row for name, row
+                             in zip(itertools.islice(names, size), cells))
+
+def main():
+    """
+    Write a synthetic GNI file and personality file into a directory.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("output_dir", help="the directory to write into")
+    parser.add_argument("--gni-rows", type=int, default=208,
+                        help="countries in the GNI file (default: 208)")
+    parser.add_argument("--pers-rows", type=int, default=158,
+                        help="countries in the personality file "
+                             "(default: 158)")
+    parser.add_argument("--missing-rate", type=float, default=0.02,
+                        help="rate of missing GNI years (default: 0.02)")
+    parser.add_argument("--pers-missing-rate", type=float, default=0.0,
+                        help="rate of missing shares (default: 0)")
+    parser.add_argument("--collision-rate", type=float, default=0.05,
+                        help="rate of names that contain another name "
+                             "(default: 0.05)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="random seed (default: 0)")
+    parser.add_argument("--batch-size", type=int, default=10000,
+                        help="rows made and written at once "
+                             "(default: 10000)")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    write_gni_file(os.path.join(args.output_dir, project.GNI_FILE),
+                   args.gni_rows, args.missing_rate, args.collision_rate,
+                   args.seed, args.batch_size)
+    write_pers_file(os.path.join(args.output_dir, project.PERSONALITY_FILE),
+                    args.pers_rows, args.pers_missing_rate,
+                    args.collision_rate, args.seed, args.batch_size)
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests of DS2001_final_project.py on the bundled data files.
+
+Usage: python -m pytest test_DS2001_final_project.py
+"""
+
+import os
+
+import pytest
+
+import DS2001_final_project as project
+
+@pytest.fixture(scope="module")
+def tables():
+    """
+    The bundled GNI_FILE and PERSONALITY_FILE as CountryTables.
+    """
+    gni_table = project.load_country_table(
+        os.path.join(project.DATA_DIR, project.GNI_FILE))
+    pers_table = project.load_country_table(
+        os.path.join(project.DATA_DIR, project.PERSONALITY_FILE))
+
+    return gni_table, pers_table
+
+def test_run_country_pipeline_generator(tables):
+    """
+    A generator of countries gives the same table as a list of them.
+    """
+    countries = ["Canada", "Japan"]
+    from_list = project.run_country_pipeline(countries, *tables)
+    from_generator = project.run_country_pipeline(
+        (country for country in countries), *tables)
+
+    assert [row["Country"] for row in from_generator] == countries
+    assert from_generator == from_list
+
+@pytest.mark.parametrize("k", [0, -3])
+def test_similar_countries_k(k):
+    """
+    similar_countries needs at least one country to find.
+    """
+    dataset = project.CountryDataset()
+    with pytest.raises(ValueError):
+        dataset.similar_countries("Canada", k)
+
+@pytest.mark.parametrize("n_folds", [0, 1, 10000])
+def test_cross_validate_gni_model_n_folds(tables, n_folds):
+    """
+    Every fold needs countries to train and test on.
+    """
+    with pytest.raises(ValueError):
+        project.cross_validate_gni_model(*tables, n_folds=n_folds)